@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# Copyright (C) 2026 The rpm-ostree-toolbox authors
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import sys
+import json
+import heapq
+import Queue
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+
+from .utils import log
+from .taskgraph import default_workers
+from .ostreeutil import open_repo, resolve, commit_root, walk_files, ObjectSizes
+
+UNOWNED = '(unowned)'
+# Files between two progress records
+PROGRESS_INTERVAL = 10000
+
+def _progress(msg):
+    # stdout may be the report
+    sys.stderr.write(msg + '\n')
+
+def rpm_owners(repo_path, commit):
+    """
+    Map the paths of @commit to the name of the package owning them,
+    using the rpmdb in usr/share/rpm; returns None if there isn't one
+    or rpm isn't available.
+    """
+    tmpdir = tempfile.mkdtemp(prefix='toolbox-rpmdb')
+    try:
+        dbpath = os.path.join(tmpdir, 'rpm')
+        devnull = open(os.devnull, 'w')
+        try:
+            subprocess.check_call(['ostree', '--repo=' + repo_path, 'checkout', '-U',
+                                   '--subpath=/usr/share/rpm', commit, dbpath],
+                                  stdout=devnull, stderr=devnull)
+            out = subprocess.check_output(['rpm', '--dbpath=' + dbpath, '-qa',
+                                           '--qf', '[%{NAME}\t%{FILENAMES}\n]'],
+                                          stderr=devnull)
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        finally:
+            devnull.close()
+    finally:
+        shutil.rmtree(tmpdir)
+    owners = {}
+    for line in out.splitlines():
+        name, _, path = line.partition('\t')
+        # rpm-ostree moves /etc to /usr/etc
+        if path.startswith('/etc/'):
+            path = '/usr' + path
+        owners[path] = name
+    return owners
+
+class CommitAnalysis(object):
+    """ Size statistics of a commit: the @top largest files, totals per
+    directory down to @depth levels and per owning package.  Objects
+    present at several paths count in full at each of them, but only
+    once in the unique totals.
+    """
+
+    def __init__(self, top=500, depth=3, owners=None):
+        self.top = top
+        self.depth = depth
+        self.owners = owners
+        self.largest = []
+        self.directories = {}
+        self.packages = {}
+        self.files = 0
+        self.size = 0
+        self.unique = set()
+        self.unique_size = 0
+        self.stored_size = 0
+
+    def _tally(self, table, key, size):
+        entry = table.get(key)
+        if entry is None:
+            entry = table[key] = [0, 0]
+        entry[0] += size
+        entry[1] += 1
+
+    def add(self, path, checksum, size, stored):
+        if checksum not in self.unique:
+            self.unique.add(checksum)
+            self.stored_size += stored
+            if size is not None:
+                self.unique_size += size
+        if size is None:
+            return
+        self.files += 1
+        self.size += size
+        item = (size, path, checksum)
+        if len(self.largest) < self.top:
+            heapq.heappush(self.largest, item)
+        elif item > self.largest[0]:
+            heapq.heapreplace(self.largest, item)
+        parts = path.split('/')
+        for i in xrange(1, min(len(parts) - 2, self.depth) + 1):
+            self._tally(self.directories, '/'.join(parts[:i + 1]), size)
+        if self.owners is not None:
+            self._tally(self.packages, self.owners.get(path, UNOWNED), size)
+
+    def file_record(self, path, checksum, size, stored):
+        record = { 'type': 'file', 'path': path, 'size': size,
+                   'stored-size': stored, 'object': checksum }
+        if self.owners is not None:
+            record['package'] = self.owners.get(path, UNOWNED)
+        return record
+
+    def progress_record(self):
+        return { 'type': 'progress', 'files': self.files, 'size': self.size,
+                 'objects': len(self.unique) }
+
+    def records(self):
+        """Yield the aggregate results as JSON-serializable dicts."""
+        for rank, (size, path, checksum) in enumerate(sorted(self.largest, reverse=True)):
+            yield { 'type': 'largest', 'rank': rank + 1, 'path': path,
+                    'size': size, 'object': checksum }
+        for path in sorted(self.directories):
+            size, count = self.directories[path]
+            yield { 'type': 'directory', 'path': path, 'size': size, 'files': count }
+        for name in sorted(self.packages, key=lambda n: -self.packages[n][0]):
+            size, count = self.packages[name]
+            yield { 'type': 'package', 'name': name, 'size': size, 'files': count }
+        yield { 'type': 'total', 'files': self.files, 'size': self.size,
+                'objects': len(self.unique), 'unique-size': self.unique_size,
+                'stored-size': self.stored_size }
+
+def analyze(repo, commit, analysis, workers=None, on_file=None):
+    """Walk @commit, looking up object sizes with a pool of threads,
+    and feed every file to @analysis, then to @on_file(path, checksum,
+    size, stored) if given."""
+    sizes = ObjectSizes(repo)
+    todo = Queue.Queue(maxsize=4096)
+    done = Queue.Queue()
+    errors = []
+    nworkers = workers or default_workers()
+
+    def worker():
+        while True:
+            item = todo.get()
+            if item is None:
+                done.put(None)
+                return
+            path, checksum = item
+            try:
+                done.put((path, checksum) + sizes.get(checksum))
+            except Exception as e:
+                errors.append(e)
+                done.put((path, checksum, None, 0))
+
+    def walker():
+        try:
+            for item in walk_files(repo, commit_root(repo, commit)[0]):
+                todo.put(item)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            for _ in xrange(nworkers):
+                todo.put(None)
+
+    threads = [threading.Thread(target=walker)]
+    threads.extend(threading.Thread(target=worker) for _ in xrange(nworkers))
+    for t in threads:
+        t.daemon = True
+        t.start()
+    finished = 0
+    while finished < nworkers:
+        item = done.get()
+        if item is None:
+            finished += 1
+            continue
+        analysis.add(*item)
+        if on_file is not None:
+            on_file(*item)
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0]
+
+def main(cmd):
+    parser = argparse.ArgumentParser(description='Report what takes up space in an OSTree commit, as JSON lines')
+    parser.add_argument('--repo', default=os.path.join(os.getcwd(), 'repo'), help='Path to OSTree repository (default: ${pwd}/repo)')
+    parser.add_argument('-n', '--top', type=int, default=500, help='Number of largest files to list')
+    parser.add_argument('--depth', type=int, default=3, help='Report directory totals down to this depth')
+    parser.add_argument('--no-packages', action='store_true', help="Don't attribute sizes to packages")
+    parser.add_argument('--workers', type=int, default=None, help='Number of threads looking up object sizes')
+    parser.add_argument('--no-files', action='store_true', help="Don't write a record for each file as it is walked, only progress and the results")
+    parser.add_argument('-o', '--output', default='-', help='Write the report to this file (default: standard output)')
+    parser.add_argument('rev', help='Ref or commit to analyze')
+    args = parser.parse_args()
+
+    repo = open_repo(args.repo)
+    commit = resolve(repo, args.rev)
+
+    owners = None
+    if not args.no_packages:
+        owners = rpm_owners(args.repo, commit)
+        if owners is None:
+            _progress("No rpmdb found in {0}; not attributing sizes to packages".format(commit))
+
+    _progress("Analyzing {0}".format(commit))
+    analysis = CommitAnalysis(top=args.top, depth=args.depth, owners=owners)
+    out = sys.stdout if args.output == '-' else open(args.output, 'w')
+
+    def write(record):
+        out.write(json.dumps(record, sort_keys=True) + '\n')
+
+    def on_file(path, checksum, size, stored):
+        if size is None:
+            return
+        if not args.no_files:
+            write(analysis.file_record(path, checksum, size, stored))
+        if analysis.files % PROGRESS_INTERVAL == 0:
+            write(analysis.progress_record())
+            out.flush()
+
+    try:
+        write({ 'type': 'commit', 'rev': args.rev, 'commit': commit })
+        analyze(repo, commit, analysis, workers=args.workers, on_file=on_file)
+        for record in analysis.records():
+            write(record)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+            log("Wrote " + args.output)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# Copyright (C) 2026 The rpm-ostree-toolbox authors
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import mmap
+import Queue
+import hashlib
+import threading
+
+from .utils import log
+from .taskgraph import default_workers
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+def hash_file(path):
+    """SHA-256 of @path, reading it through mmap."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return h.hexdigest()
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for offset in xrange(0, size, CHUNK_SIZE):
+                h.update(buffer(m, offset, CHUNK_SIZE))
+        finally:
+            m.close()
+    return h.hexdigest()
+
+def hash_files(paths, workers=None):
+    """Hash every path in @paths using a pool of threads (hashlib
+    drops the GIL while digesting); returns a dict path => digest."""
+    results = {}
+    errors = []
+    q = Queue.Queue()
+    for path in paths:
+        q.put(path)
+
+    def worker():
+        while True:
+            try:
+                path = q.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[path] = hash_file(path)
+            except (IOError, OSError) as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=worker)
+               for _ in xrange(min(workers or default_workers(), len(paths)))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0]
+    return results
+
+def _stat_key(path):
+    st = os.stat(path)
+    return (st.st_size, st.st_mtime)
+
+class HashingWriter(object):
+    """ A write-only file which computes the SHA-256 of everything
+    written to it, and hands the result to @sink once it is closed
+    successfully.
+    """
+
+    def __init__(self, path, sink=None):
+        self.path = path
+        self._sink = sink
+        self._f = open(path, 'wb')
+        self._hash = hashlib.sha256()
+
+    def write(self, buf):
+        self._hash.update(buf)
+        self._f.write(buf)
+
+    def close(self, record=True):
+        if self._f is None:
+            return
+        self._f.close()
+        self._f = None
+        if record and self._sink is not None:
+            self._sink.record(self.path, self._hash.hexdigest())
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close(record=exc_type is None)
+
+class ChecksumSink(object):
+    """ Collects the SHA-256 of artifacts as they are written, so that
+    the SHA256SUMS file doesn't need to read them back from disk.
+    Entries are keyed on the size and mtime of the file at the time it
+    was recorded; anything which changed afterwards, or which was
+    produced by an external program, is hashed again at the end.
+    """
+
+    def __init__(self):
+        self._sums = {}
+        self._lock = threading.Lock()
+
+    def open(self, path):
+        return HashingWriter(path, self)
+
+    def record(self, path, digest):
+        path = os.path.abspath(path)
+        key = _stat_key(path)
+        with self._lock:
+            self._sums[path] = (key, digest)
+
+    def copy(self, src, dest):
+        """Like shutil.copyfile(), but recording the checksum of @dest."""
+        with open(src, 'rb') as fin:
+            with self.open(dest) as fout:
+                while True:
+                    buf = fin.read(CHUNK_SIZE)
+                    if not buf:
+                        break
+                    fout.write(buf)
+
+    def moved(self, src, dest):
+        """Note that the file or directory @src was renamed to @dest."""
+        src = os.path.abspath(src)
+        dest = os.path.abspath(dest)
+        with self._lock:
+            for path in self._sums.keys():
+                if path == src or path.startswith(src + '/'):
+                    self._sums[dest + path[len(src):]] = self._sums.pop(path)
+
+    def lookup(self, path):
+        path = os.path.abspath(path)
+        with self._lock:
+            entry = self._sums.get(path)
+        if entry is None:
+            return None
+        key, digest = entry
+        if _stat_key(path) != key:
+            return None
+        return digest
+
+    def write_sums(self, topdir, sumsfile, workers=None):
+        """Write a sha256sum(1)-compatible file for every file under
+        @topdir, except other *SUMS files."""
+        paths = []
+        for dirpath, dirnames, filenames in os.walk(topdir):
+            dirnames.sort()
+            for name in sorted(filenames):
+                if name.endswith('SUMS'):
+                    continue
+                paths.append(os.path.join(dirpath, name))
+        digests = {}
+        missing = []
+        for path in paths:
+            digest = self.lookup(path)
+            if digest is None:
+                missing.append(path)
+            else:
+                digests[path] = digest
+        log("Checksums: {0} recorded while writing, {1} to compute".format(len(digests), len(missing)))
+        digests.update(hash_files(missing, workers=workers))
+        with open(sumsfile, 'w') as f:
+            for path in paths:
+                f.write('{0}  ./{1}\n'.format(digests[path], os.path.relpath(path, topdir)))
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# Copyright (C) 2026 The rpm-ostree-toolbox authors
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import json
+
+from .utils import log
+from .ostreeutil import commit_root, load_dirtree, walk_files, ObjectSizes
+
+class CommitDiff(object):
+    """ The differences in content between two commits.  Only
+    subtrees whose dirtree checksum differs are walked.
+    """
+
+    def __init__(self, repo, from_commit, to_commit):
+        self.from_commit = from_commit
+        self.to_commit = to_commit
+        self.added = []
+        self.removed = []
+        self.modified = []
+        self._sizes = ObjectSizes(repo)
+        self._repo = repo
+        self._diff_tree('', commit_root(repo, from_commit)[0], commit_root(repo, to_commit)[0])
+
+        old_objects = set(c for _, c in self.removed)
+        old_objects.update(c for _, c, _ in self.modified)
+        new_objects = set(c for _, c in self.added)
+        new_objects.update(c for _, _, c in self.modified)
+        # Objects a client wouldn't already have, as far as the
+        # changed parts of the old commit tell
+        self.new_objects = new_objects - old_objects
+
+    def _diff_tree(self, path, from_tree, to_tree):
+        if from_tree == to_tree:
+            return
+        from_files, from_dirs = load_dirtree(self._repo, from_tree)
+        to_files, to_dirs = load_dirtree(self._repo, to_tree)
+        from_files = dict(from_files)
+        to_files = dict(to_files)
+        for name in sorted(set(from_files) | set(to_files)):
+            child = path + '/' + name
+            old = from_files.get(name)
+            new = to_files.get(name)
+            if old is None:
+                self.added.append((child, new))
+            elif new is None:
+                self.removed.append((child, old))
+            elif old != new:
+                self.modified.append((child, old, new))
+        from_dirs = dict((name, tree) for name, tree, _ in from_dirs)
+        to_dirs = dict((name, tree) for name, tree, _ in to_dirs)
+        for name in sorted(set(from_dirs) | set(to_dirs)):
+            child = path + '/' + name
+            old = from_dirs.get(name)
+            new = to_dirs.get(name)
+            if old is None:
+                self.added.extend(walk_files(self._repo, new, child))
+            elif new is None:
+                self.removed.extend(walk_files(self._repo, old, child))
+            else:
+                self._diff_tree(child, old, new)
+
+    def _size(self, checksum):
+        return self._sizes.get(checksum)[0] or 0
+
+    def size_delta(self):
+        """Change in the total size of regular files, in bytes."""
+        delta = sum(self._size(c) for _, c in self.added)
+        delta -= sum(self._size(c) for _, c in self.removed)
+        delta += sum(self._size(new) - self._size(old) for _, old, new in self.modified)
+        return delta
+
+    def estimated_delta_size(self):
+        """Upper bound on the size of a static delta between the two
+        commits: the stored size of every new object."""
+        return sum(self._sizes.get(c)[1] for c in self.new_objects)
+
+    def summary(self):
+        return { 'from': self.from_commit,
+                 'to': self.to_commit,
+                 'added': len(self.added),
+                 'removed': len(self.removed),
+                 'modified': len(self.modified),
+                 'size-delta': self.size_delta(),
+                 'new-objects': len(self.new_objects),
+                 'estimated-delta-size': self.estimated_delta_size() }
+
+    def log_summary(self, top=10):
+        s = self.summary()
+        log("Diff {0} => {1}".format(s['from'], s['to']))
+        log("  {0} added, {1} removed, {2} modified files; {3:+d} bytes".format(
+            s['added'], s['removed'], s['modified'], s['size-delta']))
+        log("  {0} new content objects; estimated static delta size {1} bytes".format(
+            s['new-objects'], s['estimated-delta-size']))
+        changes = [(self._size(c), '+', p) for p, c in self.added]
+        changes.extend((self._size(new) - self._size(old), '~', p)
+                       for p, old, new in self.modified)
+        changes.sort(key=lambda c: -abs(c[0]))
+        if changes[:top]:
+            log("  Largest changes:")
+        for size, kind, path in changes[:top]:
+            log("    {0} {1:+12d} {2}".format(kind, size, path))
+
+    def write_json(self, path):
+        """Write the summary, then one line per changed file."""
+        with open(path, 'w') as f:
+            f.write(json.dumps(dict(self.summary(), type='summary'), sort_keys=True) + '\n')
+            for p, c in self.added:
+                f.write(json.dumps({ 'type': 'added', 'path': p, 'size': self._size(c) }) + '\n')
+            for p, c in self.removed:
+                f.write(json.dumps({ 'type': 'removed', 'path': p, 'size': self._size(c) }) + '\n')
+            for p, old, new in self.modified:
+                f.write(json.dumps({ 'type': 'modified', 'path': p, 'old-size': self._size(old),
+                                     'size': self._size(new) }) + '\n')
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# Copyright (C) 2026 The rpm-ostree-toolbox authors
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import json
+import os
+import shutil
+import tempfile
+import subprocess
+import distutils.spawn
+
+from .utils import fail_msg, run_sync, log
+from .checksums import HashingWriter, CHUNK_SIZE
+from .fileops import place_file
+
+# codec name => (program, extension, maximum level, multithreading flags)
+CODECS = { 'gzip': ('gzip', '.gz', 9, []),
+           'gzip-parallel': ('pigz', '.gz', 11, []),
+           'zstd': ('zstd', '.zst', 22, ['-T0']),
+           'xz': ('xz', '.xz', 9, ['-T0']),
+           'zip': ('zip', '.zip', 9, []),
+         }
+
+# Output types which are compressed unless told otherwise, and how
+DEFAULT_CODECS = { 'qcow2': 'gzip',
+                   'azure': 'zip' }
+
+OUTPUT_TYPES = ['qcow2', 'raw', 'hyperv', 'azure']
+
+class Compressor(object):
+    """ Compresses a finished image with one of CODECS, streaming it
+    from its source location, and records what it did in a
+    <artifact>.compression.json file next to the result.
+    """
+
+    def __init__(self, codec, level=None):
+        if codec not in CODECS:
+            fail_msg("Unknown compression codec {0}; known codecs are {1}".format(codec, sorted(CODECS.keys()) + ['none']))
+        program, self.extension, maxlevel, self._threadflags = CODECS[codec]
+        if level is not None and not 1 <= level <= maxlevel:
+            fail_msg("Compression level for {0} must be between 1 and {1}".format(codec, maxlevel))
+        self.codec = codec
+        self.program = program
+        self.level = level
+
+    def _ensure_program(self):
+        if distutils.spawn.find_executable(self.program) is not None:
+            return
+        if self.codec == 'gzip-parallel':
+            log("pigz not found, falling back to single-threaded gzip")
+            self.codec = 'gzip'
+            self.program = 'gzip'
+        else:
+            fail_msg("Compression codec {0} requires {1}, which is not installed".format(self.codec, self.program))
+
+    def __str__(self):
+        if self.level is None:
+            return self.codec
+        return '{0}:{1}'.format(self.codec, self.level)
+
+    def _argv(self):
+        argv = [self.program, '-c'] + self._threadflags
+        if self.level is not None:
+            if self.codec == 'zstd' and self.level > 19:
+                argv.append('--ultra')
+            argv.append('-{0}'.format(self.level))
+        return argv
+
+    def compress(self, src, dest, remove_source=False, sink=None):
+        """Compress @src into @dest (which should end in
+        self.extension), optionally deleting @src afterwards.  The
+        checksum of @dest is recorded into @sink if given."""
+        self._ensure_program()
+        origsize = os.path.getsize(src)
+        if self.codec == 'zip':
+            self._zip(src, dest, remove_source)
+        else:
+            argv = self._argv()
+            log("Running: %s < %s > %s" % (subprocess.list2cmdline(argv), src, dest))
+            with open(src, 'rb') as fin:
+                proc = subprocess.Popen(argv, stdin=fin, stdout=subprocess.PIPE)
+                with HashingWriter(dest, sink) as fout:
+                    while True:
+                        buf = proc.stdout.read(CHUNK_SIZE)
+                        if not buf:
+                            break
+                        fout.write(buf)
+                    if proc.wait() != 0:
+                        raise subprocess.CalledProcessError(proc.returncode, argv)
+            if remove_source:
+                os.unlink(src)
+        self._write_metadata(dest, origsize)
+        return dest
+
+    def _zip(self, src, dest, remove_source):
+        """zip stores the name of @src, so make sure that is the name
+        of @dest without the extension, e.g. foo.qcow2 in foo.qcow2.zip."""
+        name = os.path.basename(dest)
+        if name.endswith(self.extension):
+            name = name[:-len(self.extension)]
+        argv = ['zip', '-j']
+        if self.level is not None:
+            argv.append('-{0}'.format(self.level))
+        if os.path.basename(src) == name:
+            if remove_source:
+                argv.append('-m')
+            run_sync(argv + [dest, src])
+            return
+        linkdir = tempfile.mkdtemp(prefix='.zip-', dir=os.path.dirname(os.path.abspath(dest)))
+        try:
+            link = os.path.join(linkdir, name)
+            try:
+                os.link(src, link)
+            except OSError:
+                place_file(src, link)
+            run_sync(argv + [dest, link])
+        finally:
+            shutil.rmtree(linkdir)
+        if remove_source:
+            os.unlink(src)
+
+    def _write_metadata(self, dest, origsize):
+        size = os.path.getsize(dest)
+        meta = { 'codec': self.codec,
+                 'level': self.level,
+                 'original-size': origsize,
+                 'compressed-size': size,
+                 'ratio': round(float(size) / origsize, 4) if origsize else None }
+        with open(dest + '.compression.json', 'w') as f:
+            json.dump(meta, f, indent=4, sort_keys=True)
+        log("Compressed {0} with {1}: {2} => {3} bytes".format(os.path.basename(dest), self, origsize, size))
+
+def parse_codec(spec):
+    """Parse CODEC[:LEVEL]; returns None for 'none'."""
+    codec, _, level = spec.partition(':')
+    if codec == 'none':
+        return None
+    if level:
+        try:
+            level = int(level)
+        except ValueError:
+            fail_msg("Invalid compression level in {0}".format(spec))
+    else:
+        level = None
+    return Compressor(codec, level)
+
+def parse_specs(specs, disabled=False):
+    """
+    Map each entry of OUTPUT_TYPES to a Compressor (or None), from a
+    list of [TYPE=]CODEC[:LEVEL] strings.  A spec without a TYPE
+    replaces the codec of every type that is compressed by default.
+    """
+    if disabled:
+        return dict((t, None) for t in OUTPUT_TYPES)
+    selected = dict((t, DEFAULT_CODECS.get(t, 'none')) for t in OUTPUT_TYPES)
+    for spec in specs or []:
+        if '=' in spec:
+            outtype, _, codecspec = spec.partition('=')
+            if outtype == 'kvm':
+                outtype = 'qcow2'
+            if outtype not in OUTPUT_TYPES:
+                fail_msg("Cannot compress output type {0}; valid types are {1}".format(outtype, OUTPUT_TYPES))
+            selected[outtype] = codecspec
+        else:
+            for outtype in DEFAULT_CODECS:
+                selected[outtype] = spec
+    return dict((t, parse_codec(c)) for t, c in selected.iteritems())
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# Copyright (C) 2026 The rpm-ostree-toolbox authors
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import json
+import hashlib
+import threading
+import iniparse
+import ConfigParser  # for errors
+
+from .utils import STATEDIR, fail_msg
+
+# Parsed config files of this process, by (path, mtime, size)
+_memo = {}
+_memo_lock = threading.Lock()
+
+def _encode(value):
+    # json gives back unicode; the rest of the code expects str
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, list):
+        return [_encode(v) for v in value]
+    if isinstance(value, dict):
+        return dict((_encode(k), _encode(v)) for k, v in value.iteritems())
+    return value
+
+class ResolvedProfile(object):
+    """ The settings of one profile of a config.ini, with the DEFAULT
+    section folded in and every value interpolated once.
+    """
+
+    def __init__(self, name, values):
+        self.name = name
+        self._values = values
+
+    def get(self, key, default=None):
+        return self._values.get(key, default)
+
+    def __contains__(self, key):
+        return key in self._values
+
+class ConfigFile(object):
+    """ A config.ini, resolved into ResolvedProfile objects.  The result
+    is cached in the toolbox state directory, keyed by the content hash
+    of the file, so most invocations don't need to parse it at all.
+    """
+
+    def __init__(self, path, statedir=STATEDIR):
+        self.path = path
+        with open(path) as f:
+            self._digest = hashlib.sha256(f.read()).hexdigest()
+        self._cachepath = os.path.join(statedir, 'config-cache', self._digest + '.json')
+        self._settings = None
+        self._profiles = self._load_cache()
+
+    def _load_cache(self):
+        try:
+            with open(self._cachepath) as f:
+                return _encode(json.load(f))
+        except (IOError, ValueError):
+            return None
+
+    def _save_cache(self):
+        try:
+            cachedir = os.path.dirname(self._cachepath)
+            if not os.path.isdir(cachedir):
+                os.makedirs(cachedir)
+            tmp = '{0}.{1}.tmp'.format(self._cachepath, os.getpid())
+            with open(tmp, 'w') as f:
+                json.dump(self._profiles, f)
+            os.rename(tmp, self._cachepath)
+        except (IOError, OSError):
+            # Only an optimization
+            pass
+
+    def _resolve(self):
+        settings = iniparse.ConfigParser()
+        try:
+            settings.read(self.path)
+        except ConfigParser.ParsingError as e:
+            fail_msg("Error parsing your config file {0}: {1}".format(self.path, e.message))
+        profiles = {}
+        errors = {}
+        for section in ['DEFAULT'] + settings.sections():
+            # items() includes the DEFAULT values
+            try:
+                profiles[section] = dict(settings.items(section))
+            except ConfigParser.InterpolationError as e:
+                # Only fatal if that profile is used
+                errors[section] = str(e)
+        self._profiles = { 'sections': settings.sections(),
+                           'profiles': profiles,
+                           'errors': errors }
+        self._save_cache()
+
+    def sections(self):
+        if self._profiles is None:
+            self._resolve()
+        return list(self._profiles['sections'])
+
+    def profile(self, name):
+        if self._profiles is None:
+            self._resolve()
+        values = self._profiles['profiles'].get(name)
+        if name in self._profiles['errors']:
+            fail_msg("Error in profile {0} of your config file {1}: {2}".format(
+                name, self.path, self._profiles['errors'][name]))
+        if values is None:
+            fail_msg("Section {0} is not defined in your config file ({1}). Valid sections/profiles are {2}".format(
+                name, self.path, self._profiles['sections']))
+        return ResolvedProfile(name, values)
+
+def load_config(path):
+    """Returns the ConfigFile for @path, parsing it at most once per
+    process as long as it doesn't change."""
+    if not os.path.isfile(path):
+        fail_msg("No config file: " + path)
+    st = os.stat(path)
+    key = (os.path.realpath(path), st.st_mtime, st.st_size)
+    with _memo_lock:
+        config = _memo.get(key)
+        if config is None:
+            config = ConfigFile(path)
+            _memo[key] = config
+    return config
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# Copyright (C) 2026 The rpm-ostree-toolbox authors
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import subprocess
+import functools
+
+from .utils import fail_msg, run_sync, log
+from .taskgraph import TaskGraph
+from .ostreeutil import commit_history, repo_lock
+
+class StaticDeltas(object):
+    """ Maintains the static deltas of a repository: deltas to the tip
+    of a ref from its previous commits, pruning of deltas whose target
+    is no longer the tip of any ref, and the summary file.
+    """
+
+    def __init__(self, repo_path, repo):
+        self.repo_path = repo_path
+        self.repo = repo
+
+    def _ostree(self, *args):
+        return ['ostree', '--repo=' + self.repo_path] + list(args)
+
+    def existing(self):
+        """Names of the deltas in the repository: FROM-TO, or just TO
+        for deltas from scratch."""
+        out = subprocess.check_output(self._ostree('static-delta', 'list'))
+        return set(line.strip() for line in out.splitlines()
+                   if line.strip() and not line.startswith('('))
+
+    def generate(self, ref, depth, workers=None):
+        """Generate the missing deltas to the tip of @ref from its
+        @depth previous commits."""
+        _,tip = self.repo.resolve_rev(ref, False)
+        existing = self.existing()
+        graph = TaskGraph(workers=workers)
+        for parent in commit_history(self.repo, tip, depth):
+            name = '{0}-{1}'.format(parent, tip)
+            if name in existing:
+                continue
+            argv = self._ostree('static-delta', 'generate', '--from=' + parent, '--to=' + tip)
+            graph.add(name, functools.partial(run_sync, argv))
+        failed = graph.run()
+        if failed:
+            fail_msg("Failed to generate static deltas: " + ", ".join(failed))
+
+    def prune(self):
+        """Delete the deltas whose target isn't the tip of a ref."""
+        _,refs = self.repo.list_refs(None, None)
+        tips = set(refs.values())
+        for name in sorted(self.existing()):
+            target = name.rsplit('-', 1)[-1]
+            if target in tips:
+                continue
+            log("Deleting static delta {0}".format(name))
+            run_sync(self._ostree('static-delta', 'delete', name))
+
+    def update_summary(self):
+        run_sync(self._ostree('summary', '-u'))
+
+def update_static_deltas(repo_path, repo, refs, depth, workers=None):
+    """Post-compose stage, once per repository: deltas for each of
+    @refs, pruning, summary."""
+    deltas = StaticDeltas(repo_path, repo)
+    with repo_lock(repo_path):
+        if depth > 0:
+            for ref in sorted(set(refs)):
+                deltas.generate(ref, depth, workers=workers)
+            deltas.prune()
+        deltas.update_summary()
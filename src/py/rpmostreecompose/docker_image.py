@@ -16,22 +16,16 @@
 # Free Software Foundation, Inc., 59 Temple Place - Suite 330,
 # Boston, MA 02111-1307, USA.
 
-import json
 import os
+import time
 import shutil
 import errno
 import tempfile
 import argparse
 import subprocess
-import oz.TDL
-import oz.GuestFactory
-import tarfile
-import shutil
 
 from .utils import fail_msg, run_sync, log
 
-from gi.repository import GLib # pylint: disable=no-name-in-module
-
 def clean_dir_contents(path):
     if not os.path.isdir(path):
         return
@@ -49,70 +43,105 @@ def ensure_unlinked(path):
         if e.errno != errno.ENOENT:
             raise
 
-def main(cmd):
-    parser = argparse.ArgumentParser(description='Create a docker image')
-    parser.add_argument('--reposdir', required=True, default=None, type=str, help='Path to directory with yum .repo files')
-    parser.add_argument('--enablerepo', required=True, default=[], action='append', help='Enable a repository')
-    parser.add_argument('--minimize', action='append', default=[], help='Control minimization; known types: docs, langs"')
-    parser.add_argument('--releasever', action='store', default=None, help='Set "$releasever" URL variable')
-    parser.add_argument('--tmpdir', action='store', help='Path to temporary directory')
-    parser.add_argument('--name', required=True, action='store', help='Name for docker image')
-    parser.add_argument('packages', nargs='+', help='Package name')
-    args = parser.parse_args()
+class DockerImageBuilder(object):
+    """ Builds a Docker base image by installing packages with yum into
+    a temporary root, and importing that.  The arguments are those of
+    'rpm-ostree-toolbox docker-image'.  A builder holds no state between
+    builds, so several may run at once from different threads.
+    """
 
-    instroot = tempfile.mkdtemp(prefix='toolbox-docker', dir=args.tmpdir)
+    MINIMIZE_FLAGS = { 'docs': '--setopt=tsflags=nodocs',
+                       'langs': '--setopt=override_install_langs=en' }
 
-    try:
+    def __init__(self, reposdir, enablerepo, minimize=[], releasever=None, tmpdir=None):
+        for val in minimize:
+            if val not in self.MINIMIZE_FLAGS:
+                fail_msg("Unknown minimize flag: " + val)
+        self.reposdir = reposdir
+        self.enablerepo = list(enablerepo)
+        self.minimize = list(minimize)
+        self.releasever = releasever
+        self.tmpdir = tmpdir
+
+    def _yum_argv(self, instroot, packages):
         yum_argv = ['yum', '-y', '--disablerepo=*',
                     '--installroot=' + instroot,
-                    '--setopt=reposdir=' + args.reposdir]
-        for val in args.minimize:
-            if val == 'docs':
-                yum_argv.append('--setopt=tsflags=nodocs')
-            elif val == 'langs':
-                yum_argv.append('--setopt=override_install_langs=en')
-            else:
-                fail_msg("Unknown minimize flag: " + val)
-        for val in args.enablerepo:
+                    '--setopt=reposdir=' + self.reposdir]
+        for val in self.minimize:
+            yum_argv.append(self.MINIMIZE_FLAGS[val])
+        for val in self.enablerepo:
             yum_argv.append('--enablerepo=' + val)
 
-        if args.releasever:
-            yum_argv.append('--setopt=releasever=' + args.releasever)
+        if self.releasever:
+            yum_argv.append('--setopt=releasever=' + self.releasever)
         else:
             # dnf always wants a releasever, even if the repo files aren't using one.
             yum_argv.append('--setopt=releasever=noreleasever')
 
         yum_argv.append('install')
-        yum_argv.extend(args.packages)
-
-        run_sync(yum_argv)
-
-        ensure_unlinked(instroot + '/etc/machine-id')
-        if 'langs' in args.minimize:
-            ensure_unlinked(instroot + '/usr/lib/locale/locale-archive')
-
-        # Just allow use of dnf-as-yum since renaming it all of the
-        # Dockerfiles is pointless and annoying.
-        if (os.path.exists(instroot + '/usr/bin/dnf') and
-            not os.path.exists(instroot + '/usr/bin/yum')):
-            os.symlink('dnf', instroot + '/usr/bin/yum')
-
-        varcache = instroot + '/var/cache'
-        for name in ['/tmp', '/var/cache', '/run']:
-            clean_dir_contents(instroot + name)
-
-        tarproc = subprocess.Popen(['tar', '-C', instroot, '-c', '.'],
-                                   stdout=subprocess.PIPE)
-        # Blah, docker tries to use the http proxy for localhost...
-        child_env = dict(os.environ)
-        if 'http_proxy' in child_env:
-            del child_env['http_proxy']
-        run_sync(['docker', 'import', '-', args.name], stdin=tarproc.stdout,
-                 env=child_env)
-        tarproc.wait()
-        if tarproc.returncode != 0:
-            fail_msg("tar exited with code " + tarproc.returncode)
-
-    finally:
-        shutil.rmtree(instroot)
+        yum_argv.extend(packages)
+        return yum_argv
+
+    def build(self, name, packages):
+        """
+        Create the image @name containing @packages; returns its ID and
+        a dict of the time spent in each step, in seconds.
+        """
+        timings = {}
+        start = time.time()
+        instroot = tempfile.mkdtemp(prefix='toolbox-docker', dir=self.tmpdir)
+
+        try:
+            run_sync(self._yum_argv(instroot, packages))
+            timings['install'] = time.time() - start
+
+            ensure_unlinked(instroot + '/etc/machine-id')
+            if 'langs' in self.minimize:
+                ensure_unlinked(instroot + '/usr/lib/locale/locale-archive')
+
+            # Just allow use of dnf-as-yum since renaming it all of the
+            # Dockerfiles is pointless and annoying.
+            if (os.path.exists(instroot + '/usr/bin/dnf') and
+                not os.path.exists(instroot + '/usr/bin/yum')):
+                os.symlink('dnf', instroot + '/usr/bin/yum')
+
+            for subdir in ['/tmp', '/var/cache', '/run']:
+                clean_dir_contents(instroot + subdir)
+
+            step = time.time()
+            tarproc = subprocess.Popen(['tar', '-C', instroot, '-c', '.'],
+                                       stdout=subprocess.PIPE)
+            # Blah, docker tries to use the http proxy for localhost...
+            child_env = dict(os.environ)
+            if 'http_proxy' in child_env:
+                del child_env['http_proxy']
+            import_argv = ['docker', 'import', '-', name]
+            log("Running: %s" % (subprocess.list2cmdline(import_argv), ))
+            image_id = subprocess.check_output(import_argv, stdin=tarproc.stdout,
+                                               env=child_env).strip()
+            tarproc.stdout.close()
+            tarproc.wait()
+            if tarproc.returncode != 0:
+                fail_msg("tar exited with code {0}".format(tarproc.returncode))
+            timings['import'] = time.time() - step
+        finally:
+            shutil.rmtree(instroot)
+
+        timings['total'] = time.time() - start
+        log("Created docker image {0} ({1}) in {2:.1f}s".format(name, image_id, timings['total']))
+        return image_id, timings
+
+def main(cmd):
+    parser = argparse.ArgumentParser(description='Create a docker image')
+    parser.add_argument('--reposdir', required=True, default=None, type=str, help='Path to directory with yum .repo files')
+    parser.add_argument('--enablerepo', required=True, default=[], action='append', help='Enable a repository')
+    parser.add_argument('--minimize', action='append', default=[], help='Control minimization; known types: docs, langs"')
+    parser.add_argument('--releasever', action='store', default=None, help='Set "$releasever" URL variable')
+    parser.add_argument('--tmpdir', action='store', help='Path to temporary directory')
+    parser.add_argument('--name', required=True, action='store', help='Name for docker image')
+    parser.add_argument('packages', nargs='+', help='Package name')
+    args = parser.parse_args()
 
+    builder = DockerImageBuilder(args.reposdir, args.enablerepo, minimize=args.minimize,
+                                 releasever=args.releasever, tmpdir=args.tmpdir)
+    builder.build(args.name, args.packages)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# Copyright (C) 2026 The rpm-ostree-toolbox authors
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import errno
+import fcntl
+import shutil
+import ctypes
+
+from .utils import log
+
+# From <linux/fs.h>
+FICLONE = 0x40049409
+# From <unistd.h>; Python 2 doesn't know about these
+SEEK_DATA = 3
+SEEK_HOLE = 4
+
+# Errors meaning "this strategy doesn't work here, try the next one"
+_UNSUPPORTED = (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV,
+                errno.EINVAL, errno.ENOSYS, errno.EBADF)
+
+_libc = ctypes.CDLL(None, use_errno=True)
+
+def _libc_func(name, argtypes):
+    func = getattr(_libc, name, None)
+    if func is None:
+        return None
+    func.restype = ctypes.c_ssize_t
+    func.argtypes = argtypes
+    return func
+
+_copy_file_range = _libc_func('copy_file_range',
+                              [ctypes.c_int, ctypes.POINTER(ctypes.c_longlong),
+                               ctypes.c_int, ctypes.POINTER(ctypes.c_longlong),
+                               ctypes.c_size_t, ctypes.c_uint])
+_sendfile = _libc_func('sendfile64',
+                       [ctypes.c_int, ctypes.c_int,
+                        ctypes.POINTER(ctypes.c_longlong), ctypes.c_size_t])
+
+def _check(ret):
+    if ret < 0:
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e))
+    return ret
+
+def sendfile(out_fd, in_fd, offset, count):
+    """Wrapper for sendfile(2); returns the number of bytes sent."""
+    if _sendfile is None:
+        raise OSError(errno.ENOSYS, os.strerror(errno.ENOSYS))
+    off = ctypes.c_longlong(offset)
+    return _check(_sendfile(out_fd, in_fd, ctypes.byref(off), count))
+
+def reflink(src_fd, dest_fd):
+    fcntl.ioctl(dest_fd, FICLONE, src_fd)
+
+def clone_file(src, dest):
+    """Make @dest a reflink of @src; returns False (leaving nothing
+    behind) if the filesystem can't do that."""
+    try:
+        with open(src, 'rb') as fin:
+            with open(dest, 'wb') as fout:
+                reflink(fin.fileno(), fout.fileno())
+    except IOError as e:
+        if e.errno not in _UNSUPPORTED:
+            raise
+        os.unlink(dest)
+        return False
+    log("Placed {0} => {1} (reflink)".format(src, dest))
+    return True
+
+def _data_extents(fd, size):
+    """Yield (offset, length) for each region of @fd holding data, so
+    that holes in sparse images stay holes."""
+    offset = 0
+    while offset < size:
+        try:
+            start = os.lseek(fd, offset, SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                return
+            if e.errno != errno.EINVAL:
+                raise
+            # No SEEK_DATA support; treat everything as data
+            yield (offset, size - offset)
+            return
+        end = os.lseek(fd, start, SEEK_HOLE)
+        yield (start, end - start)
+        offset = end
+
+def _copy_extent(src_fd, dest_fd, offset, length, use_sendfile):
+    while length > 0:
+        if use_sendfile:
+            os.lseek(dest_fd, offset, os.SEEK_SET)
+            n = sendfile(dest_fd, src_fd, offset, length)
+        else:
+            if _copy_file_range is None:
+                raise OSError(errno.ENOSYS, os.strerror(errno.ENOSYS))
+            off_in = ctypes.c_longlong(offset)
+            off_out = ctypes.c_longlong(offset)
+            n = _check(_copy_file_range(src_fd, ctypes.byref(off_in),
+                                        dest_fd, ctypes.byref(off_out),
+                                        length, 0))
+        if n == 0:
+            break
+        offset += n
+        length -= n
+
+def _copy_sparse(src_fd, dest_fd, use_sendfile):
+    size = os.fstat(src_fd).st_size
+    for offset, length in _data_extents(src_fd, size):
+        _copy_extent(src_fd, dest_fd, offset, length, use_sendfile)
+    os.ftruncate(dest_fd, size)
+
+def _copy_data(src, dest, sink):
+    """Copy @src to @dest with the cheapest mechanism the filesystem
+    supports; returns the name of the strategy used."""
+    with open(src, 'rb') as fin:
+        with open(dest, 'wb') as fout:
+            try:
+                reflink(fin.fileno(), fout.fileno())
+                return 'reflink'
+            except IOError as e:
+                if e.errno not in _UNSUPPORTED:
+                    raise
+            for strategy in ['copy_file_range', 'sendfile']:
+                try:
+                    _copy_sparse(fin.fileno(), fout.fileno(), strategy == 'sendfile')
+                    return strategy
+                except OSError as e:
+                    if e.errno not in _UNSUPPORTED:
+                        raise
+                    os.ftruncate(fout.fileno(), 0)
+    if sink is not None:
+        sink.copy(src, dest)
+    else:
+        shutil.copyfile(src, dest)
+    return 'copy'
+
+def place_file(src, dest, move=False, sink=None):
+    """
+    Put the contents of @src at @dest, trying in order: rename (only
+    if @move), a reflink, copy_file_range()/sendfile() skipping holes,
+    and finally a plain copy (checksummed into @sink if given).
+    """
+    strategy = None
+    if move:
+        try:
+            os.rename(src, dest)
+            strategy = 'rename'
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+    if strategy is None:
+        strategy = _copy_data(src, dest, sink)
+        shutil.copymode(src, dest)
+        if move:
+            os.unlink(src)
+    log("Placed {0} => {1} ({2})".format(src, dest, strategy))
+    return strategy
+
+def place_tree(src, dest):
+    """Like shutil.move(src, dest), using place_file() for each file
+    when @src and @dest are on different filesystems."""
+    if os.path.isdir(dest):
+        dest = os.path.join(dest, os.path.basename(src))
+    try:
+        os.rename(src, dest)
+        log("Placed {0} => {1} (rename)".format(src, dest))
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    for dirpath, dirnames, filenames in os.walk(src):
+        destdir = os.path.join(dest, os.path.relpath(dirpath, src))
+        if not os.path.isdir(destdir):
+            os.makedirs(destdir)
+            shutil.copymode(dirpath, destdir)
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), os.path.join(destdir, name))
+            else:
+                place_file(path, os.path.join(destdir, name), move=True)
+        for name in dirnames:
+            path = os.path.join(dirpath, name)
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), os.path.join(destdir, name))
+    shutil.rmtree(src)
+
+def copy_tree(src, dest):
+    """Copy the directory @src to @dest (which must not exist) with
+    place_file(), so files are reflinked where possible."""
+    for dirpath, dirnames, filenames in os.walk(src):
+        destdir = os.path.join(dest, os.path.relpath(dirpath, src))
+        if not os.path.isdir(destdir):
+            os.makedirs(destdir)
+            shutil.copymode(dirpath, destdir)
+        for name in filenames + dirnames:
+            path = os.path.join(dirpath, name)
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), os.path.join(destdir, name))
+            elif name in filenames:
+                place_file(path, os.path.join(destdir, name))
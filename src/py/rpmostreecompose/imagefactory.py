@@ -24,6 +24,7 @@ import StringIO
 import tempfile
 import argparse
 import shutil
+import threading
 import subprocess
 import distutils.spawn
 import gi
@@ -42,8 +43,13 @@ from imgfac.ApplicationConfiguration import ApplicationConfiguration
 import logging
 
 from .taskbase import ImageTaskBase
+from .taskgraph import TaskGraph, default_workers
+from . import compression
+from .fileops import place_file
+from .kickstart import KickstartFlattener
 
-from .utils import run_sync, fail_msg, TemporaryWebserver, log
+from .utils import run_sync, fail_msg, log
+from .webserver import repo_server
 
 
 class ImgBuilder(object):
@@ -108,11 +114,13 @@ class ImgFacBuilder(ImgBuilder):
             fail_msg("Failed image status: " + image.status)
         return image
 
-    def buildimagetype(self, imagetype, baseid, imgopts={}):
+    def buildimagetype(self, imagetype, baseid, imgopts=None):
         """
         This method compliments the builder method by taking its
         uuid and outputputting various image formats
         """
+        # Copied, as the vagrant and OVA options are added below
+        imgopts = dict(imgopts or {})
 
         # This dict maps the imagetype to an imageformat
         imageformats = {'kvm':'kvm', 'rhevm': 'rhevm', 'vsphere':'vsphere', 
@@ -208,8 +216,8 @@ class AbstractImageFactoryTask(ImageTaskBase):
 
         """
         if not self.ostree_repo_is_remote: 
-            self._tmpweb = TemporaryWebserver()
-            self.httpd_port = self._tmpweb.start(self.ostree_repo)
+            self._tmpweb = repo_server(self.ostree_repo, max_connections=self.httpd_max_connections)
+            self.httpd_port = self._tmpweb.port
             log("tmp httpd port={}".format(self.httpd_port))
         else:
             self.httpd_port = self.ostree_port
@@ -241,10 +249,13 @@ class AbstractImageFactoryTask(ImageTaskBase):
         # Set default image to always be KVM
         self.addozoverride('libvirt', 'image_type', defimagetype)
 
+        self.ozmemory = 2048
         if cfg.has_option("libvirt","memory"):
             if int(cfg.get("libvirt","memory")) < 2048:
                 log("Your current oz configuration specifies a memory amount of less than 2048 which can lead to possible image creation failures. Overriding temporarily to 2048")
                 self.addozoverride('libvirt', 'memory', 2048)
+            else:
+                self.ozmemory = int(cfg.get("libvirt","memory"))
 
         else:
             # We need at least 2GB of memory for imagefactory
@@ -252,6 +263,7 @@ class AbstractImageFactoryTask(ImageTaskBase):
 
         # Two cpus is prefered for producer/consumer ops
         self.addozoverride('libvirt', 'cpus', '2')
+        self.ozcpus = 2
 
         log("Oz overrides: {0}".format(self.ozoverrides))
 
@@ -302,6 +314,40 @@ class AbstractImageFactoryTask(ImageTaskBase):
         else:
             kickstart_version = 'RHEL7'
 
+        flattened = KickstartFlattener(self._ksflattenDocker).flatten(ksfile, kickstart_version)
+        flattened_ks = self.workdir + '/' + ks_basename
+        with open(flattened_ks, 'w') as f:
+            f.write(flattened)
+
+        r = re.compile('^(ostreesetup.*?)--url=[^\s]+(.*)')
+        newbuf = StringIO.StringIO()
+        for line in StringIO.StringIO(flattened):
+            for subname, subval in substitutions.iteritems():
+                if subval is None:
+                    continue
+                line = line.replace('@%s@' % (subname, ), subval)
+
+            # By default, we replace the --url with the local repo
+            # for developer convenience.  Automated use of this
+            # tool might point to an external repo.
+            if self.args.preserve_ks_url:
+                m = None
+            else:
+                m = r.match(line)
+            if m:
+                newbuf.write(m.group(1))
+                newbuf.write('--url="{0}"'.format(ostree_location))
+                newbuf.write(m.group(2))
+            else:
+                newbuf.write(line)
+            
+        return newbuf.getvalue()
+
+
+    def _ksflattenDocker(self, ksfile, kickstart_version):
+        """Run ksflatten in a kickstart worker container, for when
+        pykickstart can't be used in-process."""
+        ks_basename = os.path.basename(ksfile)
         dockerfile = """CMD ["ksflatten", "--version", "{0}", "-c", "/in/{1}", "-o", "/out/{1}"]""".format(kickstart_version, ks_basename)
         contextdir = os.path.join(self.workdir, 'tmp-kickstart')
         if os.path.isdir(contextdir): shutil.rmtree(contextdir)
@@ -317,38 +363,15 @@ class AbstractImageFactoryTask(ImageTaskBase):
             del child_env['http_proxy']
         run_sync(cmd, env=child_env)
 
-        flattened_ks = self.workdir + '/' + ks_basename
-        os.rename(contextdir + '/' + ks_basename, flattened_ks)
-
-        r = re.compile('^(ostreesetup.*?)--url=[^\s]+(.*)')
-        newbuf = StringIO.StringIO()
-        with open(flattened_ks) as f:
-            for line in f:
-                for subname, subval in substitutions.iteritems():
-                    if subval is None:
-                        continue
-                    line = line.replace('@%s@' % (subname, ), subval)
-
-                # By default, we replace the --url with the local repo
-                # for developer convenience.  Automated use of this
-                # tool might point to an external repo.
-                if self.args.preserve_ks_url:
-                    m = None
-                else:
-                    m = r.match(line)
-                if m:
-                    newbuf.write(m.group(1))
-                    newbuf.write('--url="{0}"'.format(ostree_location))
-                    newbuf.write(m.group(2))
-                else:
-                    newbuf.write(line)
-                
-        return newbuf.getvalue()
+        with open(contextdir + '/' + ks_basename) as f:
+            return f.read()
 
 
 class ImageFactoryTask(AbstractImageFactoryTask):
     def __init__(self, args, cmd, profile=None):
         AbstractImageFactoryTask.__init__(self, args, cmd, profile=profile)
+        self._builder = None
+        self.compressors = compression.parse_specs(args.compress, disabled=args.compression)
 
     def impl_create(self, name, ksfile, vkickstart, tdl, imageouttypes):
         self._name = name
@@ -378,110 +401,164 @@ class ImageFactoryTask(AbstractImageFactoryTask):
         os.mkdir(self.image_log_outputdir)
 
         self.checkoz("qcow2")
+        # The base install and the vagrant base install are independent
+        # Oz installs; run them side by side when the host has room,
+        # and start converting each one as soon as it is done.
+        graph = TaskGraph(workers=self.args.conversion_workers)
+        install_slots = threading.Semaphore(self.installBudget())
+        installs = []
+
         # The conditional handles the building of the images listed below
         if len(self.returnCommon(imageouttypes, ['rhevm', 'vsphere', 'kvm', 'raw', 'hyperv', 'azure'])) > 0:
             ksdata = self.formatKS(ksfile)
-            parameters =  { "install_script": ksdata,
-                            "generate_icicle": False,
-                            "oz_overrides": json.dumps(self.ozoverrides)
-                          }
-            log("Starting build")
-            image = self.builder.build(template=open(self._tdl).read(), parameters=parameters)
+            graph.add('base-install', lambda: self.installBase(ksdata, install_slots))
+            installs.append('base-install')
 
-            # For debug, you can comment out the above and enable the code below
-            # to skip the initial image creation.  Just point myuuid at the proper
-            # image uuid
+            # For debug, you can replace the above with a node returning
+            # an existing image, to skip the initial image creation.
+            # Just point myuuid at the proper image uuid
 
-            # self.builder.download()
             # myuuid = "51ca9b60-d856-4b68-82bb-84b715c8f233"
             # pim = PersistentImageManager.default_manager()
-            # image = pim.image_with_id(myuuid)
-
-            # Copy the qcow2 file to the outputdir, and gzip it
-            outputname = os.path.join(self.image_content_outputdir, '%s.qcow2' % (self.os_nr))
-            shutil.copyfile(image.data, outputname)
-            if not self.args.compression:
-                run_sync(['gzip', outputname])
-            log("Created: {0}".format(outputname))
-
-            if 'raw' in imageouttypes:
-                log("Processing image from qcow2 to raw")
-                outputname = os.path.join(self.image_content_outputdir, '%s.raw' % (self.os_nr))
-
-                qemucmd = ['qemu-img', 'convert', '-f', 'qcow2', '-O', 'raw', image.data, outputname]
-                run_sync(qemucmd)
-                imageouttypes.pop(imageouttypes.index("raw"))
-                log("Created: {0}".format(outputname))
-
-            if 'hyperv' in imageouttypes:
-                outputname = os.path.join(self.image_content_outputdir, '%s-hyperv.vhd' % (self.os_nr))
-                # We can only create a gen1 hyperv image with no ova right now
-                qemucmd = ['qemu-img', 'convert', '-f', 'qcow2', '-O', 'vpc', image.data, outputname]
-                run_sync(qemucmd)
-                imageouttypes.pop(imageouttypes.index("hyperv"))
-                log("Created: {0}".format(outputname))
-
-            if 'azure' in imageouttypes:
-                # We differentiate between vhds and azsure vhds due to azure enforcing
-                # a restriction of filesize.  
-                # http://azure.microsoft.com/en-us/documentation/articles/virtual-machines-linux-create-upload-vhd-generic/
-
-                outputname = os.path.join(self.image_content_outputdir, '%s-azure.vhd' % (self.os_nr))
-                temp_raw = os.path.join(os.path.dirname(image.data), "temp.raw")
-                rawcmd = ['qemu-img', 'convert', '-f', 'qcow2', '-O', 'raw', image.data, temp_raw]
-                run_sync(rawcmd)
-
-                mb = 1024 * 1024
-                # Convert qcow2 to raw
-                qemu_info_cmd = ['qemu-img', 'info', '-f', 'raw', '--output', 'json', temp_raw]
-                # Get info from raw image
-                qemu_info = json.loads(subprocess.check_output(qemu_info_cmd))
-                # Compute size dictated by azure
-                azure_size = ((qemu_info['virtual-size']/mb + 1) * mb)
-                # Resize raw image
-                run_sync(['qemu-img', 'resize', '-f', 'raw', temp_raw, str(azure_size)])
-
-                # Create azure vhd
-                run_sync(['qemu-img', 'convert', '-f', 'raw', '-o', 'subformat=fixed,force_size', '-O', 'vpc', temp_raw, outputname])
-                # Remove raw image
-                os.remove(temp_raw)
-
-                log("Created: {0}".format(outputname))
-
-                # Zip if more captabile with windows
-                if not self.args.compression:
-                    run_sync(['zip', '-j', '-m', outputname + ".zip", outputname])
-
-            for imagetype in self.returnCommon(imageouttypes, ['rhevm','vsphere']):
-                self.generateOVA(imagetype, "ova", image)
-
-            os.unlink(image.data) 
+            # graph.add('base-install', lambda: pim.image_with_id(myuuid))
+
+            self.addConversions(graph, 'base-install', imageouttypes)
 
         # This conditional handles the vagrant images
         if self.vagrant:
             # vagrant images need a new base image with changes in the KS
-            ksdata = self.formatKS(self.vksfile)
-            parameters =  { "install_script": ksdata,
-                            "generate_icicle": False,
-                            "oz_overrides": json.dumps(self.ozoverrides)
-                           }
-            vimage = self.builder.build(template=open(self._tdl).read(), parameters=parameters)
+            vksdata = self.formatKS(self.vksfile)
+            graph.add('vagrant-install', lambda: self.installBase(vksdata, install_slots))
+            installs.append('vagrant-install')
 
             for imagetype in self.returnCommon(imageouttypes, ['vagrant-libvirt','vagrant-virtualbox']):
-                self.generateOVA(imagetype, "box", vimage)
+                graph.add(imagetype, lambda image, imagetype=imagetype: self.generateOVA(imagetype, "box", image),
+                          deps=['vagrant-install'])
 
-            os.unlink(vimage.data) 
+        failed = graph.run()
+        graph.log_summary("Build times:")
+
+        for install in installs:
+            image = graph.result(install)
+            if image is not None:
+                os.unlink(image.data)
 
         self._destroy_httpd()
 
+        if failed:
+            fail_msg("Failed to create: {0}".format(", ".join(failed)))
+
+    def installBudget(self):
+        """
+        How many Oz installs can run at once, given the memory and
+        cpus each guest gets from the oz overrides.
+        """
+        if self.args.max_parallel_installs:
+            return self.args.max_parallel_installs
+        with open('/proc/meminfo') as f:
+            meminfo = dict(line.split(':', 1) for line in f)
+        host_memory = int(meminfo['MemTotal'].split()[0]) / 1024
+        # Leave a quarter of the host memory for the conversions
+        by_memory = int(host_memory * 0.75) / self.ozmemory
+        by_cpus = default_workers() / self.ozcpus
+        budget = max(1, min(by_memory, by_cpus))
+        log("Running up to {0} installs at once ({1}MB and {2} cpus each)".format(budget, self.ozmemory, self.ozcpus))
+        return budget
+
+    def installBase(self, ksdata, install_slots):
+        parameters =  { "install_script": ksdata,
+                        "generate_icicle": False,
+                        "oz_overrides": json.dumps(self.ozoverrides)
+                      }
+        with install_slots:
+            log("Starting build")
+            return self.builder.build(template=open(self._tdl).read(), parameters=parameters)
+
     @property
     def builder(self):
         # TODO: option to switch to koji builder
-        if True:
+        # Conversions run in parallel, so share one builder rather than
+        # re-loading the plugins (and logging handlers) from each thread.
+        if self._builder is None:
             global verbosemode
-            return ImgFacBuilder(workdir=self.workdir, verbosemode=verbosemode)
+            self._builder = ImgFacBuilder(workdir=self.workdir, verbosemode=verbosemode)
+        return self._builder
+
+    def addConversions(self, graph, install, imageouttypes):
+        """
+        Schedule every output derived from the base image built by the
+        @install node onto @graph.  They only read image.data, so they
+        are all independent of each other.
+        """
+        graph.add('qcow2', self.convertQcow2, deps=[install])
+        if 'raw' in imageouttypes:
+            graph.add('raw', self.convertRaw, deps=[install])
+        if 'hyperv' in imageouttypes:
+            graph.add('hyperv', self.convertHyperv, deps=[install])
+        if 'azure' in imageouttypes:
+            graph.add('azure', self.convertAzure, deps=[install])
+        for imagetype in self.returnCommon(imageouttypes, ['rhevm','vsphere']):
+            graph.add(imagetype, lambda image, imagetype=imagetype: self.generateOVA(imagetype, "ova", image),
+                      deps=[install])
+
+    def compressOutput(self, outtype, outputname, remove_source=True):
+        compressor = self.compressors[outtype]
+        if compressor is None:
+            return outputname
+        return compressor.compress(outputname, outputname + compressor.extension,
+                                   remove_source=remove_source, sink=self.checksums)
+
+    def convertQcow2(self, image):
+        # Compress the qcow2 file straight into the outputdir, or just
+        # copy it there if compression is off.  The other conversions
+        # are still reading image.data, so it can't be moved.
+        outputname = os.path.join(self.image_content_outputdir, '%s.qcow2' % (self.os_nr))
+        compressor = self.compressors['qcow2']
+        if compressor is None:
+            place_file(image.data, outputname, sink=self.checksums)
         else:
-            return KojiBuilder()
+            outputname = compressor.compress(image.data, outputname + compressor.extension,
+                                             sink=self.checksums)
+        log("Created: {0}".format(outputname))
+
+    def convertRaw(self, image):
+        log("Processing image from qcow2 to raw")
+        outputname = os.path.join(self.image_content_outputdir, '%s.raw' % (self.os_nr))
+
+        qemucmd = ['qemu-img', 'convert', '-f', 'qcow2', '-O', 'raw', image.data, outputname]
+        run_sync(qemucmd)
+        outputname = self.compressOutput('raw', outputname)
+        log("Created: {0}".format(outputname))
+
+    def convertHyperv(self, image):
+        outputname = os.path.join(self.image_content_outputdir, '%s-hyperv.vhd' % (self.os_nr))
+        # We can only create a gen1 hyperv image with no ova right now
+        qemucmd = ['qemu-img', 'convert', '-f', 'qcow2', '-O', 'vpc', image.data, outputname]
+        run_sync(qemucmd)
+        outputname = self.compressOutput('hyperv', outputname)
+        log("Created: {0}".format(outputname))
+
+    def convertAzure(self, image):
+        # We differentiate between vhds and azsure vhds due to azure enforcing
+        # a restriction of filesize.  
+        # http://azure.microsoft.com/en-us/documentation/articles/virtual-machines-linux-create-upload-vhd-generic/
+
+        outputname = os.path.join(self.image_content_outputdir, '%s-azure.vhd' % (self.os_nr))
+
+        # Get the virtual size straight from the qcow2 header
+        qemu_info_cmd = ['qemu-img', 'info', '-f', 'qcow2', '--output', 'json', image.data]
+        qemu_info = json.loads(subprocess.check_output(qemu_info_cmd))
+        azure_size = azureVhdSize(qemu_info['virtual-size'])
+
+        # Pre-create the fixed VHD at the size azure wants, then have
+        # qemu-img write the qcow2 contents into it (-n) rather than
+        # going through a resized temporary raw copy.
+        run_sync(['qemu-img', 'create', '-f', 'vpc', '-o', 'subformat=fixed,force_size', outputname, str(azure_size)])
+        run_sync(['qemu-img', 'convert', '-n', '-f', 'qcow2', '-O', 'vpc', image.data, outputname])
+
+        # Zipped by default, as that is more compatible with windows
+        outputname = self.compressOutput('azure', outputname)
+        log("Created: {0}".format(outputname))
 
 
     def generateOVA(self, imagetype, fileext, image):
@@ -496,7 +573,9 @@ class ImageFactoryTask(AbstractImageFactoryTask):
         target_image = self.builder.buildimagetype(imagetype, image.identifier, imgopts=imgopts)
         infile = target_image.data
         outfile = os.path.join(self.image_content_outputdir, '%s-%s.%s' % (self._name, imagetype, fileext))
-        shutil.copyfile(infile, outfile)
+        # target_image.data belongs to imagefactory's image store, so
+        # copy (ideally reflink) it out rather than renaming it away.
+        place_file(infile, outfile, sink=self.checksums)
         log("Created: {0}".format(outfile))
 
 
@@ -540,6 +619,17 @@ def getDefaultIP(hostnet=None):
 
 
 
+def azureVhdSize(virtual_size):
+    """
+    Azure requires the virtual size of a VHD to be a whole number of
+    MiB; returns @virtual_size truncated to a MiB boundary plus one
+    MiB, so an already aligned size also grows by 1 MiB (as it always
+    has).
+    """
+    mb = 1024 * 1024
+    return (virtual_size/mb + 1) * mb
+
+
 def parseimagetypes(imagetypes):
     default_image_types = ["kvm", "raw", "vsphere", "rhevm", "vagrant-virtualbox", "vagrant-libvirt", "hyperv", "azure"]
     if imagetypes == None:
@@ -564,6 +654,10 @@ def main(cmd):
     parser.add_argument('-k', '--kickstart', type=str, required=False, default=None, help='Path to kickstart') 
     parser.add_argument('--vkickstart', type=str, required=False, help='Path to vagrant kickstart')
     parser.add_argument('--no-compression', default=False, action='store_true', dest='compression', required=False, help='Do not compress final images.')
+    parser.add_argument('--compress', action='append', default=[], metavar='[TYPE=]CODEC[:LEVEL]',
+                        help='Compression for final images; CODEC is one of none, gzip, gzip-parallel, zstd, xz, zip and TYPE one of qcow2, raw, hyperv, azure (default: qcow2=gzip, azure=zip).  Without TYPE, applies to the types compressed by default')
+    parser.add_argument('--max-parallel-installs', type=int, default=0, help='Maximum number of base image installs to run at once (default: as many as the oz memory and cpu settings allow)')
+    parser.add_argument('--conversion-workers', type=int, default=default_workers(), help='Maximum number of installs and image conversions to run at once (default: number of CPUs)')
     parser.add_argument('-p', '--profile', type=str, default='DEFAULT', help='Profile to compose (references a stanza in the config file)')
     parser.add_argument('-s', '--screenshot_dir', type=str, required=False, help='Directory to store screenshots of failed installs')
     parser.add_argument('-v', '--verbose', action='store_true', help='verbose output')
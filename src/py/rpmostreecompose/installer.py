@@ -18,6 +18,8 @@
 
 import json
 import os
+import glob
+import hashlib
 import shutil
 import argparse
 import subprocess
@@ -27,7 +29,12 @@ import tarfile
 import shutil
 
 from .taskbase import ImageTaskBase
-from .utils import fail_msg, run_sync, TemporaryWebserver, log
+from .utils import fail_msg, run_sync, log
+from .installermirror import InstallerMirror
+from .loraxcache import LoraxCache, lorax_cache_key
+from .repometa import repomd_checksum
+from .repoindex import repo_index
+from .workercache import docker_image_id, docker_image_label
 from .imagefactory import AbstractImageFactoryTask
 from .imagefactory import ImgFacBuilder
 from imgfac.BuildDispatcher import BuildDispatcher
@@ -37,6 +44,9 @@ from .imagefactory import getDefaultIP
 
 from gi.repository import GLib  # pylint: disable=no-name-in-module
 
+# Docker label holding the hash of the lorax image's template and script
+LORAX_INPUTS_LABEL = 'org.projectatomic.rpm-ostree-toolbox.lorax-inputs'
+
 class InstallerTask(ImageTaskBase):
     container_id = ""
 
@@ -50,27 +60,24 @@ class InstallerTask(ImageTaskBase):
         log("Wrote {0}".format(fullpathname))
         return fullpathname
 
-    def _buildDockerImage(self, docker_image_name):
-        docker_image_basename = self.buildDockerWorkerBaseImage('lorax', ['lorax', 'rpm-ostree', 'ostree'])
-
+    def _loraxCommand(self):
+        """ Returns the lorax command line, and the repository URLs
+        it composes from.
+        """
         lorax_repos = []
         # This is hacky since we need to support CentOS 7 lorax which only knows
         # -s/-m and not --repo
         if self.lorax_inherit_repos is not None:
             repoids,repos = self.getrepos(self.jsonfilename)
-            baseurls = {}
+            index = repo_index(self.configdir)
             for repoid in repoids:
-                with open('{}/{}.repo'.format(self.configdir, repoid)) as f:
-                    baseurl = None
-                    for line in f:
-                        if line.startswith('baseurl='):
-                            baseurl = line[len('baseurl='):].strip()
-                            break
-                    if baseurl is None:
-                        fail_msg("Didn't find baseurl= in {}".format(repoid))
-                    baseurls[repoid] = baseurl
-            for repoid,baseurl in baseurls.iteritems():
-                lorax_repos.extend(['-s', baseurl])
+                entry = index.get(repoid)
+                if entry is None:
+                    # Eg. lorax_additional_repos, which are added below
+                    continue
+                if entry.baseurl is None:
+                    fail_msg("Didn't find baseurl= in {}".format(repoid))
+                lorax_repos.extend(['-s', entry.baseurl])
 
         if self.lorax_additional_repos:
             if self.yum_baseurl not in self.lorax_additional_repos:
@@ -108,25 +115,43 @@ class InstallerTask(ImageTaskBase):
                 if include == '': continue
                 lorax_cmd.extend(['-i', include.strip()])
         lorax_cmd.append('/out/lorax')
-
+        return lorax_cmd, lorax_repos[1::2]
+
+    def _loraxCacheKey(self, lorax_cmd, repourls, lorax_tmpl, commit, worker):
+        if worker is None:
+            log("Not caching lorax output; the lorax worker image is missing")
+            return None
+        repomd = {}
+        for url in repourls:
+            repomd[url] = repomd_checksum(url, self.arch, self.release)
+            if repomd[url] is None:
+                log("Not caching lorax output; can't identify the revision of " + url)
+                return None
+        return lorax_cache_key(lorax_cmd, lorax_tmpl, repomd, commit, worker)
+
+    def _loraxShell(self, lorax_cmd):
         # There is currently a bug for loop devices in containers,
         # so we make at least one device to be sure.
         # https://groups.google.com/forum/#!msg/docker-user/JmHko2nstWQ/5iuzVf67vfEJ
-        lorax_shell = """#!/bin/sh\n
+        return """#!/bin/sh\n
 for x in $(seq 0 6); do
   path=/dev/loop${{x}}
   if ! test -b ${{path}}; then mknod -m660 ${{path}} b 7 ${{x}}; fi
 done
-sed -e "s,@OSTREE_URL@,${{OSTREE_URL}},"  < /root/lorax.tmpl.in > /root/lorax.tmpl
 echo Running: {0}
 exec {0}
 """.format(" ".join(map(GLib.shell_quote, lorax_cmd)))
+
+    def _buildDockerImage(self, docker_image_name, lorax_shell, docker_image_basename, inputs):
         self.dumpTempMeta(os.path.join(self.workdir, "lorax.sh"), lorax_shell)
 
-        docker_subs = {'DOCKER_OS': docker_image_basename}
+        docker_subs = {'DOCKER_OS': docker_image_basename,
+                       'LABEL': LORAX_INPUTS_LABEL,
+                       'INPUTS': inputs}
         docker_file = """
 FROM @DOCKER_OS@
-ADD lorax.tmpl /root/lorax.tmpl.in
+LABEL @LABEL@=@INPUTS@
+ADD lorax.tmpl /root/lorax.tmpl
 ADD lorax.sh /root/
 RUN mkdir /out
 RUN if rpm -q subscription-manager 1>/dev/null 2>&1; then yum -y remove subscription-manager; fi
@@ -154,21 +179,12 @@ CMD ["/bin/sh", "/root/lorax.sh"]
             post_str = '%r' % ('%post --erroronfail\n' + open(post).read() + '\n%end\n', )
             lorax_tmpl += '\nappend usr/share/anaconda/interactive-defaults.ks %s\n' % (post_str, ) 
 
-        port_file_path = self.workdir + '/repo-port'
-        if not self.ostree_repo_is_remote:
-            tmpweb = TemporaryWebserver()
-            httpd_port = tmpweb.start(self.ostree_repo)
-            httpd_url = '127.0.0.1'
-            ostree_url = "http://{0}:{1}".format(httpd_url, httpd_port)
-            log("tmp httpd serving {} at {}".format(self.ostree_repo, ostree_url))
-        else:
-            httpd_port = self.httpd_port
-            httpd_url = self.httpd_host
-            ostree_url = self.ostree_repo
-
-        # Test connectivity to the the ostree repository.  Here we look for
-        # for the repository's /config file.
-        self._require_ostree_repo(ostree_url)
+        if self.ostree_repo_is_remote:
+            # Test connectivity to the the ostree repository.  Here we look for
+            # for the repository's /config file.
+            self._require_ostree_repo(self.ostree_repo)
+        elif not os.path.isfile(os.path.join(self.ostree_repo, 'config')):
+            fail_msg("Unable to find OSTree repository config in {0}; Please verify the location and re-run.".format(self.ostree_repo))
 
         substitutions = {'OSTREE_REF':  self.ref,
                          'OSTREE_OSNAME':  self.os_name,
@@ -176,7 +192,6 @@ CMD ["/bin/sh", "/root/lorax.sh"]
                          'OS_PRETTY': self.os_pretty_name,
                          'OS_VER': self.release,
                          'OS_VER': self.release,
-                         'OSTREE_URL': ostree_url
                          }
 
         for subname, subval in substitutions.iteritems():
@@ -192,42 +207,75 @@ CMD ["/bin/sh", "/root/lorax.sh"]
         for i in parts[1:]:
             docker_os += '/%s' % i.replace(".", "")
         docker_image_name = '{0}/rpmostree-toolbox-lorax'.format(docker_os)
-        if not ('docker-lorax' in self.args.skip_subtask):
-            self._buildDockerImage(docker_image_name)
+        lorax_cmd, lorax_repourls = self._loraxCommand()
+        lorax_shell = self._loraxShell(lorax_cmd)
+        # Identifies the template and script baked into the lorax image
+        lorax_inputs = hashlib.sha256(lorax_tmpl + '\0' + lorax_shell).hexdigest()
+        lorax_output = self.image_workdir + '/lorax'
+        cache = LoraxCache()
+
+        # The worker image carries the lorax version, so it is part
+        # of the cache key; with docker-lorax skipped, the existing
+        # lorax image is what runs.
+        skip_docker = 'docker-lorax' in self.args.skip_subtask
+        if skip_docker:
+            docker_image_basename = None
+            worker_id = docker_image_id(docker_image_name)
+            if worker_id is not None and docker_image_label(docker_image_name, LORAX_INPUTS_LABEL) != lorax_inputs:
+                # It would run its own copy of an older template and
+                # lorax command, which may not even use the mirror
+                fail_msg("The {0} image was built for a different lorax template or command; "
+                         "re-run without --skip-subtask docker-lorax to rebuild it".format(docker_image_name))
         else:
-            log("Skipping subtask docker-lorax")
-
-        # Docker run
-        dr_cidfile = os.path.join(self.workdir, "containerid")
-
-        dr_cmd = ['docker', 'run', '--rm', '--workdir', '/out', '--net=host', '--privileged=true',
-                  '-v', '{0}:{1}'.format(self.image_workdir, '/out'), docker_image_name]
-
-        child_env = dict(os.environ)
-        if 'http_proxy' in child_env:
-            del child_env['http_proxy']
-        run_sync(dr_cmd, env=child_env)
-
-        if not self.ostree_repo_is_remote:
-            tmpweb.stop()
+            docker_image_basename = self.buildDockerWorkerBaseImage('lorax', ['lorax', 'rpm-ostree', 'ostree'])
+            worker_id = docker_image_id(docker_image_basename)
+
+        with InstallerMirror(self.ostree_repo, self.ref, self.ostree_repo_is_remote) as mirror:
+            cache_key = None
+            if self.lorax_cache_max_entries > 0:
+                cache_key = self._loraxCacheKey(lorax_cmd, lorax_repourls, lorax_tmpl,
+                                                mirror.rev_parse(), worker_id)
+            if cache_key is None or not cache.restore(cache_key, lorax_output, self.image_workdir):
+                if not skip_docker:
+                    self._buildDockerImage(docker_image_name, lorax_shell, docker_image_basename,
+                                           lorax_inputs)
+                else:
+                    log("Skipping subtask docker-lorax")
+
+                # Docker run
+                dr_cmd = ['docker', 'run', '--rm', '--workdir', '/out', '--net=host', '--privileged=true',
+                          '-v', '{0}:{1}'.format(self.image_workdir, '/out'),
+                          '-v', '{0}:{1}:ro'.format(mirror.path, '/ostree-mirror'),
+                          docker_image_name]
+
+                child_env = dict(os.environ)
+                if 'http_proxy' in child_env:
+                    del child_env['http_proxy']
+                run_sync(dr_cmd, env=child_env)
+
+                if cache_key is not None:
+                    cache.store(cache_key, lorax_output,
+                                logs=glob.glob(os.path.join(self.image_workdir, '*.log')))
+                    cache.evict(self.lorax_cache_max_entries)
 
         # We injected data into boot.iso, so it's now installer.iso
-        lorax_output = self.image_workdir + '/lorax'
         lorax_images = lorax_output + '/images'
         os.rename(lorax_images + '/boot.iso', lorax_images + '/installer.iso')
 
         treeinfo = lorax_output + '/.treeinfo'
         treeinfo_tmp = treeinfo + '.tmp'
         with open(treeinfo) as treein:
-            with open(treeinfo_tmp, 'w') as treeout:
+            with self.checksums.open(treeinfo_tmp) as treeout:
                 for line in treein:
                     if line.startswith('boot.iso'):
                         treeout.write(line.replace('boot.iso', 'installer.iso'))
                     else:
                         treeout.write(line)
         os.rename(treeinfo_tmp, treeinfo)
+        self.checksums.moved(treeinfo_tmp, treeinfo)
 
         os.rename(lorax_output, self.image_content_outputdir)
+        self.checksums.moved(lorax_output, self.image_content_outputdir)
         os.mkdir(self.image_log_outputdir)
         for fname in os.listdir(self.image_workdir):
             if not fname.endswith('.log'):
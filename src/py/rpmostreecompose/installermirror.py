@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# Copyright (C) 2026 The rpm-ostree-toolbox authors
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import fcntl
+import hashlib
+import subprocess
+
+from .utils import STATEDIR, run_sync, log
+from .ostreeutil import repo_lock
+
+class InstallerMirror(object):
+    """ A persistent archive-z2 repository holding the one commit of
+    @ref that goes into the installer ISO.  Each build only transfers
+    the objects that changed since the previous one; lorax then copies
+    the mirror into the ISO with pull-local.
+
+    Use as a context manager: the mirror is updated on entry, and
+    stays locked against concurrent updates until exit.
+    """
+
+    def __init__(self, source, ref, is_remote, statedir=STATEDIR):
+        self.source = source
+        self.ref = ref
+        self.is_remote = is_remote
+        key = hashlib.sha256(source + '\0' + ref).hexdigest()[:16]
+        self.path = os.path.join(statedir, 'installer-mirrors', key)
+        self._lockf = None
+
+    def _repo_cmd(self, *args):
+        return ['ostree', '--repo=' + self.path] + list(args)
+
+    def update(self):
+        if not os.path.isdir(os.path.join(self.path, 'objects')):
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            run_sync(self._repo_cmd('init', '--mode=archive-z2'))
+        log("Updating installer mirror {0} of {1} {2}".format(self.path, self.source, self.ref))
+        if self.is_remote:
+            # The remote is re-added so that a changed URL is picked up
+            run_sync(self._repo_cmd('remote', 'delete', '--if-exists', 'origin'))
+            run_sync(self._repo_cmd('remote', 'add', '--set=gpg-verify=false',
+                                    'origin', self.source))
+            run_sync(self._repo_cmd('pull', '--mirror', 'origin', self.ref))
+        else:
+            # Keep gc from deleting objects of @source while they're copied
+            with repo_lock(self.source):
+                run_sync(self._repo_cmd('pull-local', self.source, self.ref))
+        # Only the commit being installed is needed
+        run_sync(self._repo_cmd('prune', '--refs-only', '--depth=0'))
+
+    def __enter__(self):
+        parent = os.path.dirname(self.path)
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        self._lockf = open(self.path + '.lock', 'w')
+        fcntl.flock(self._lockf.fileno(), fcntl.LOCK_EX)
+        try:
+            self.update()
+        except:
+            self._lockf.close()
+            self._lockf = None
+            raise
+        # Other builds of the same ref may read it, but not update it
+        fcntl.flock(self._lockf.fileno(), fcntl.LOCK_SH)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self._lockf.close()
+        self._lockf = None
+
+    def rev_parse(self):
+        """Checksum of the mirrored commit."""
+        return subprocess.check_output(self._repo_cmd('rev-parse', self.ref)).strip()
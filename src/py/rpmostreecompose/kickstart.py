@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# Copyright (C) 2026 The rpm-ostree-toolbox authors
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import re
+import hashlib
+import threading
+
+from .utils import STATEDIR, log
+
+_include_re = re.compile(r'^\s*%(?:include|ksappend)\s+(\S+)')
+
+# Flattened kickstarts kept in the state directory
+MAX_CACHED_KICKSTARTS = 50
+
+# Flattened kickstarts of this process, by kickstart_key()
+_memo = {}
+_memo_lock = threading.Lock()
+
+def _kickstart_tree(ksfile):
+    """Returns the kickstart @ksfile followed by every file it pulls
+    in with %include/%ksappend, recursively."""
+    files = []
+    pending = [os.path.abspath(ksfile)]
+    while pending:
+        path = pending.pop(0)
+        if path in files:
+            continue
+        files.append(path)
+        if not os.path.isfile(path):
+            continue
+        with open(path) as f:
+            for line in f:
+                m = _include_re.match(line)
+                if m is None:
+                    continue
+                included = m.group(1)
+                if '://' in included:
+                    # Remote includes are resolved by the flattener
+                    continue
+                pending.append(os.path.join(os.path.dirname(path), included))
+    return files
+
+def kickstart_key(ksfile, version):
+    """Hash of the kickstart content, of everything it includes, and
+    of the syntax @version it is flattened with."""
+    h = hashlib.sha256()
+    h.update(version + '\0')
+    for path in _kickstart_tree(ksfile):
+        h.update(path + '\0')
+        if os.path.isfile(path):
+            with open(path) as f:
+                h.update(hashlib.sha256(f.read()).hexdigest())
+        h.update('\0')
+    return h.hexdigest()
+
+def _flatten_pykickstart(ksfile, version):
+    """Equivalent of 'ksflatten --version @version -c @ksfile'; returns
+    None if pykickstart isn't available or doesn't know @version."""
+    try:
+        from pykickstart.errors import KickstartError
+        from pykickstart.parser import KickstartParser, preprocessKickstart
+        from pykickstart.version import makeVersion, stringToVersion
+    except ImportError:
+        return None
+    try:
+        handler = makeVersion(stringToVersion(version))
+    except KickstartError:
+        log("Local pykickstart doesn't know kickstart version {0}".format(version))
+        return None
+    parser = KickstartParser(handler, followIncludes=True)
+    processed = preprocessKickstart(ksfile)
+    try:
+        parser.readKickstart(processed)
+    finally:
+        os.unlink(processed)
+    return str(parser.handler)
+
+class KickstartFlattener(object):
+    """ Flattens kickstarts in-process with pykickstart, caching the
+    result in memory and in the toolbox state directory.  If that
+    isn't possible, the @fallback callable (ksfile, version) => text
+    does the work instead, and its result is cached the same way.
+    Only the @max_entries most recently used results stay on disk.
+    """
+
+    def __init__(self, fallback, statedir=STATEDIR, max_entries=MAX_CACHED_KICKSTARTS):
+        self._fallback = fallback
+        self._cachedir = os.path.join(statedir, 'kickstart-cache')
+        self._max_entries = max_entries
+
+    def evict(self):
+        """Remove all but the most recently used cached kickstarts."""
+        entries = []
+        for name in os.listdir(self._cachedir):
+            if not name.endswith('.ks'):
+                continue
+            path = os.path.join(self._cachedir, name)
+            entries.append((os.stat(path).st_mtime, path))
+        entries.sort(reverse=True)
+        for _, path in entries[self._max_entries:]:
+            try:
+                os.unlink(path)
+            except OSError:
+                # Evicted concurrently
+                pass
+
+    def flatten(self, ksfile, version):
+        key = kickstart_key(ksfile, version)
+        with _memo_lock:
+            text = _memo.get(key)
+        if text is not None:
+            return text
+
+        cachepath = os.path.join(self._cachedir, key + '.ks')
+        if os.path.isfile(cachepath):
+            log("Using cached flattened kickstart for {0}".format(ksfile))
+            with open(cachepath) as f:
+                text = f.read()
+            os.utime(cachepath, None)
+        else:
+            text = _flatten_pykickstart(ksfile, version)
+            if text is None:
+                text = self._fallback(ksfile, version)
+            else:
+                log("Flattened {0} in-process".format(ksfile))
+            if not os.path.isdir(self._cachedir):
+                os.makedirs(self._cachedir)
+            tmp = '{0}.{1}.tmp'.format(cachepath, os.getpid())
+            with open(tmp, 'w') as f:
+                f.write(text)
+            os.rename(tmp, cachepath)
+            self.evict()
+
+        with _memo_lock:
+            _memo[key] = text
+        return text
@@ -19,9 +19,11 @@
 import argparse
 import os
 import shutil
+import subprocess
 
 from .taskbase import ImageTaskBase
 from .utils import fail_msg, run_sync, log
+from .fileops import clone_file
 from .imagefactory import AbstractImageFactoryTask
 from .imagefactory import ImgFacBuilder
 from .installer import InstallerTask
@@ -125,21 +127,34 @@ CMD ["/bin/sh", "/root/lmc_shell.sh"]
             db_cmd = ['docker', 'build', '-t', docker_image_name, os.path.dirname(tmp_docker_file)]
             run_sync(db_cmd, env=child_env)
 
-        # FIXME; why are we copying the input disk?
-        run_sync(['cp', '-v', '--sparse=auto', diskimage, self.image_workdir + "/lmc_input_disk"])
+        # The container expects a writable disk at /out/lmc_input_disk.
+        # If the filesystem supports it, give it a private reflinked
+        # copy; otherwise a qcow2 overlay backed by the original, which
+        # is bind mounted read-only at its own path so that the overlay's
+        # backing file reference resolves inside the container too.
+        lmc_input_disk = self.image_workdir + "/lmc_input_disk"
+        disk_volume = []
+        if not clone_file(diskimage, lmc_input_disk):
+            backing = os.path.realpath(diskimage)
+            qemu_info = json.loads(subprocess.check_output(['qemu-img', 'info', '--output', 'json', backing]))
+            run_sync(['qemu-img', 'create', '-f', 'qcow2', '-b', backing,
+                      '-F', qemu_info['format'], lmc_input_disk])
+            disk_volume = ['-v', '{0}:{0}:ro'.format(backing)]
+            log("Using a qcow2 overlay of {0} as the input disk".format(diskimage))
 
         try:
             dr_cmd = ['docker', 'run', '--rm', '--workdir', '/out', '--net=host',
-                      '--privileged=true', '-v', '{0}:{1}'.format(self.image_workdir, '/out'),
-                      '-v', '/sys/fs/selinux:/sys/fs/selinux',
-                      docker_image_name]
+                      '--privileged=true', '-v', '{0}:{1}'.format(self.image_workdir, '/out')]
+            dr_cmd.extend(disk_volume)
+            dr_cmd.extend(['-v', '/sys/fs/selinux:/sys/fs/selinux',
+                           docker_image_name])
             child_env = dict(os.environ)
             if 'http_proxy' in child_env:
                 del child_env['http_proxy']
             run_sync(dr_cmd, env=child_env)
         finally:
-            # Remove temporary image
-            os.unlink(self.image_workdir + "/lmc_input_disk")
+            # Remove the clone or overlay
+            os.unlink(lmc_input_disk)
 
         os.rename(self.image_workdir + '/images', self.image_content_outputdir)
         os.mkdir(self.image_log_outputdir)
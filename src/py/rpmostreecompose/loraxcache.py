@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# Copyright (C) 2026 The rpm-ostree-toolbox authors
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import json
+import time
+import glob
+import shutil
+import hashlib
+
+from .utils import STATEDIR, log
+from .fileops import copy_tree
+
+def lorax_cache_key(lorax_cmd, template, repomd, commit, worker):
+    """
+    Compute the key of a lorax result from everything that goes into
+    it: the lorax command line, the template, the metadata revision of
+    each lorax repo (standing in for the package set), the checksum
+    of the commit embedded in the ISO, and the ID of the worker image
+    holding the lorax, rpm-ostree and ostree that run.
+    """
+    inputs = { 'lorax': lorax_cmd,
+               'template': hashlib.sha256(template).hexdigest(),
+               'repomd': repomd,
+               'commit': commit,
+               'worker': worker }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True)).hexdigest()
+
+class LoraxCache(object):
+    """ Keeps the output directories of recent lorax runs along with
+    their logs, so that an installer build whose inputs didn't change
+    can skip lorax.
+    """
+
+    def __init__(self, statedir=STATEDIR):
+        self.path = os.path.join(statedir, 'lorax-cache')
+
+    def _entry(self, key):
+        return os.path.join(self.path, key)
+
+    def restore(self, key, dest, logdir):
+        """Copy the cached output for @key to @dest, and the logs of
+        the lorax run which produced it to @logdir; returns False on
+        a miss."""
+        entry = self._entry(key)
+        output = os.path.join(entry, 'output')
+        if not os.path.isdir(output):
+            return False
+        built = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(os.stat(output).st_mtime))
+        log("Restoring lorax output built on {0} from the cache ({1}); lorax did not run".format(built, entry))
+        copy_tree(output, dest)
+        for path in glob.glob(os.path.join(entry, 'logs', '*')):
+            name = os.path.join(logdir, os.path.basename(path))
+            shutil.copyfile(path, name)
+            log("Restored cached lorax log {0}".format(name))
+        # Entries are evicted least recently used first
+        os.utime(entry, None)
+        return True
+
+    def store(self, key, src, logs=()):
+        """Cache the lorax output directory @src and the log files
+        @logs under @key."""
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        entry = self._entry(key)
+        tmp = '{0}.{1}.tmp'.format(entry, os.getpid())
+        copy_tree(src, os.path.join(tmp, 'output'))
+        os.makedirs(os.path.join(tmp, 'logs'))
+        for path in logs:
+            shutil.copyfile(path, os.path.join(tmp, 'logs', os.path.basename(path)))
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # A concurrent build stored it first
+            shutil.rmtree(tmp)
+        log("Cached lorax output as {0}".format(entry))
+
+    def evict(self, max_entries):
+        """Remove all but the @max_entries most recently used entries."""
+        if not os.path.isdir(self.path):
+            return
+        entries = []
+        for name in os.listdir(self.path):
+            path = self._entry(name)
+            if name.endswith('.tmp') or not os.path.isdir(path):
+                continue
+            entries.append((os.stat(path).st_mtime, path))
+        entries.sort(reverse=True)
+        for _, path in entries[max_entries:]:
+            log("Evicting cached lorax output {0}".format(path))
+            shutil.rmtree(path)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# Copyright (C) 2026 The rpm-ostree-toolbox authors
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import fcntl
+import hashlib
+import threading
+import contextlib
+
+from gi.repository import Gio, OSTree  # pylint: disable=no-name-in-module
+
+from .utils import STATEDIR, fail_msg
+
+def repo_key(repo_path):
+    """Names the toolbox state kept about the repository @repo_path."""
+    return hashlib.sha256(os.path.realpath(repo_path)).hexdigest()
+
+@contextlib.contextmanager
+def repo_lock(repo_path, exclusive=False, statedir=STATEDIR):
+    """Held shared while writing objects to @repo_path or copying
+    them out of it, and exclusively while deleting objects from it, so
+    that objects of a commit which isn't referenced yet, or is being
+    pulled, aren't garbage collected."""
+    lockdir = os.path.join(statedir, 'repo-locks')
+    if not os.path.isdir(lockdir):
+        os.makedirs(lockdir)
+    with open(os.path.join(lockdir, repo_key(repo_path) + '.lock'), 'w') as lockf:
+        fcntl.flock(lockf.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lockf.fileno(), fcntl.LOCK_UN)
+
+def open_repo(path):
+    repo = OSTree.Repo.new(Gio.File.new_for_path(path))
+    try:
+        repo.open(None)
+    except Exception as e:
+        fail_msg("Unable to open OSTree repository {0}: {1}".format(path, e))
+    return repo
+
+def resolve(repo, rev):
+    _,checksum = repo.resolve_rev(rev, True)
+    if checksum is None:
+        fail_msg("No such ref or commit: " + rev)
+    return checksum
+
+def commit_history(repo, commit, depth):
+    """Returns up to @depth ancestors of @commit, closest first,
+    stopping at the first one that isn't in @repo."""
+    ancestors = []
+    while len(ancestors) < depth:
+        _,variant = repo.load_variant(OSTree.ObjectType.COMMIT, commit)
+        parent = OSTree.commit_get_parent(variant)
+        if parent is None:
+            break
+        _,parentv = repo.load_variant_if_exists(OSTree.ObjectType.COMMIT, parent)
+        if parentv is None:
+            break
+        ancestors.append(parent)
+        commit = parent
+    return ancestors
+
+def commit_info(repo, commit):
+    """Returns (timestamp, version, parent) of @commit; the version
+    and parent may be None."""
+    _,variant = repo.load_variant(OSTree.ObjectType.COMMIT, commit)
+    version = variant.get_child_value(0).lookup_value('version', None)
+    if version is not None:
+        version = version.get_string()
+    return (OSTree.commit_get_timestamp(variant), version,
+            OSTree.commit_get_parent(variant))
+
+def commit_root(repo, commit):
+    """Returns the (dirtree, dirmeta) checksums of the root of @commit."""
+    _,variant = repo.load_variant(OSTree.ObjectType.COMMIT, commit)
+    return (OSTree.checksum_from_bytes_v(variant.get_child_value(6)),
+            OSTree.checksum_from_bytes_v(variant.get_child_value(7)))
+
+def load_dirtree(repo, checksum):
+    """Returns the files [(name, content checksum)] and subdirectories
+    [(name, dirtree checksum, dirmeta checksum)] of a dirtree object."""
+    _,variant = repo.load_variant(OSTree.ObjectType.DIR_TREE, checksum)
+    filesv = variant.get_child_value(0)
+    dirsv = variant.get_child_value(1)
+    files = []
+    for i in xrange(filesv.n_children()):
+        entry = filesv.get_child_value(i)
+        files.append((entry.get_child_value(0).get_string(),
+                      OSTree.checksum_from_bytes_v(entry.get_child_value(1))))
+    dirs = []
+    for i in xrange(dirsv.n_children()):
+        entry = dirsv.get_child_value(i)
+        dirs.append((entry.get_child_value(0).get_string(),
+                     OSTree.checksum_from_bytes_v(entry.get_child_value(1)),
+                     OSTree.checksum_from_bytes_v(entry.get_child_value(2))))
+    return files, dirs
+
+def walk_files(repo, tree, prefix=''):
+    """Yield (path, content checksum) for every file under the dirtree
+    @tree, reading only dirtree objects."""
+    stack = [(prefix, tree)]
+    while stack:
+        path, checksum = stack.pop()
+        files, dirs = load_dirtree(repo, checksum)
+        for name, csum in files:
+            yield (path + '/' + name, csum)
+        for name, csum, _ in reversed(dirs):
+            stack.append((path + '/' + name, csum))
+
+class ObjectSizes(object):
+    """ Looks up the size of content objects, once per object; safe
+    to use from several threads.
+    """
+
+    def __init__(self, repo):
+        self.repo = repo
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def get(self, checksum):
+        """Returns (size, stored size) of the content object @checksum;
+        the size is None for anything but regular files."""
+        with self._lock:
+            sizes = self._sizes.get(checksum)
+        if sizes is not None:
+            return sizes
+        _,stream,info,_ = self.repo.load_file(checksum, None)
+        if stream is not None:
+            stream.close(None)
+        size = None
+        if info.get_file_type() == Gio.FileType.REGULAR:
+            size = info.get_size()
+        _,stored = self.repo.query_object_storage_size(OSTree.ObjectType.FILE, checksum, None)
+        sizes = (size, stored)
+        with self._lock:
+            self._sizes[checksum] = sizes
+        return sizes
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# Copyright (C) 2026 The rpm-ostree-toolbox authors
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import argparse
+import fnmatch
+import sqlite3
+import contextlib
+
+from gi.repository import OSTree  # pylint: disable=no-name-in-module
+
+from .utils import STATEDIR, fail_msg, log
+from .config import load_config
+from .workercache import parse_size
+from .ostreeutil import open_repo, repo_key, repo_lock, commit_history, commit_info
+from .versionindex import VersionIndex
+
+# Object types which are only ever reachable through a commit
+_TREE_OBJECTS = (OSTree.ObjectType.DIR_TREE, OSTree.ObjectType.DIR_META,
+                 OSTree.ObjectType.FILE)
+
+def format_size(size):
+    for unit in ['bytes', 'KiB', 'MiB', 'GiB']:
+        if abs(size) < 1024 or unit == 'GiB':
+            break
+        size /= 1024.0
+    if unit == 'bytes':
+        return '{0} bytes'.format(size)
+    return '{0:.1f} {1}'.format(size, unit)
+
+class GCPolicy(object):
+    """ What a garbage collection run keeps: the last @keep commits of
+    every ref, any commit whose version matches one of the fnmatch
+    patterns of @keep_versions, and at most @max_cache_size bytes of
+    packages in the rpm-ostree cachedir.  At most @max_delete commits
+    are deleted per run, so a large backlog is worked off over several
+    runs instead of in one long one.
+    """
+
+    def __init__(self, keep=10, keep_versions=(), max_cache_size=None, max_delete=None):
+        self.keep = keep
+        self.keep_versions = list(keep_versions)
+        self.max_cache_size = max_cache_size
+        self.max_delete = max_delete
+
+    def keeps_version(self, version):
+        return (version is not None and
+                any(fnmatch.fnmatch(version, p) for p in self.keep_versions))
+
+_REACHABLE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS traversed (commit_checksum TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS reachable (commit_checksum TEXT NOT NULL,
+                                      checksum TEXT NOT NULL, objtype INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS reachable_by_commit ON reachable (commit_checksum);
+"""
+
+class ReachableObjects(object):
+    """ The objects each commit of a repository references, kept in
+    the toolbox state directory.  Commits never change, so each one
+    is only traversed the first time it is seen.
+    """
+
+    def __init__(self, repo_path, repo, statedir=STATEDIR):
+        self.repo = repo
+        dbdir = os.path.join(statedir, 'gc-reachable')
+        if not os.path.isdir(dbdir):
+            os.makedirs(dbdir)
+        self.path = os.path.join(dbdir, repo_key(repo_path) + '.db')
+        with self._connect() as db:
+            db.executescript(_REACHABLE_SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=60)
+        db.text_factory = str
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def reachable(self, commits):
+        """Returns the set of (checksum, objtype) referenced by
+        @commits (without their parents), traversing only the commits
+        not seen before and forgetting those not in @commits."""
+        with self._connect() as db:
+            known = set(row[0] for row in db.execute("SELECT commit_checksum FROM traversed"))
+            for commit in known - commits:
+                db.execute("DELETE FROM reachable WHERE commit_checksum = ?", (commit,))
+                db.execute("DELETE FROM traversed WHERE commit_checksum = ?", (commit,))
+            new = commits - known
+            if new:
+                log("Traversing {0} commits not seen by a previous run".format(len(new)))
+            for commit in new:
+                _,objects = self.repo.traverse_commit(commit, 0, None)
+                db.executemany("INSERT INTO reachable VALUES (?, ?, ?)",
+                               ((commit,) + name.unpack() for name in objects))
+                db.execute("INSERT INTO traversed VALUES (?)", (commit,))
+            return set(db.execute("SELECT DISTINCT checksum, objtype FROM reachable"))
+
+class RepoGC(object):
+    """ Deletes the commits of an OSTree repository which @policy
+    doesn't keep, then the objects no kept commit references.
+
+    Only the commits kept since the previous run are traversed, each
+    without its parents.  The repository is locked for the duration,
+    so that composes don't write objects while they are collected.
+    """
+
+    def __init__(self, repo_path, policy, dry_run=False):
+        self.repo_path = repo_path
+        self.repo = open_repo(repo_path)
+        self.policy = policy
+        self.dry_run = dry_run
+
+    def plan(self):
+        """Returns (kept commits, commits to delete oldest first)."""
+        _,refs = self.repo.list_refs(None, None)
+        keep = set(refs.values())
+        for ref in sorted(refs):
+            keep.update(commit_history(self.repo, refs[ref], self.policy.keep - 1))
+
+        _,objects = self.repo.list_objects(OSTree.RepoListObjectsFlags.ALL, None)
+        candidates = []
+        for name in objects:
+            checksum, objtype = name.unpack()
+            if objtype != OSTree.ObjectType.COMMIT or checksum in keep:
+                continue
+            timestamp, version, _ = commit_info(self.repo, checksum)
+            if self.policy.keeps_version(version):
+                log("Keeping {0} (version {1})".format(checksum, version))
+                keep.add(checksum)
+            else:
+                candidates.append((timestamp, checksum))
+        candidates.sort()
+        delete = [commit for _timestamp, commit in candidates]
+        if self.policy.max_delete is not None and len(delete) > self.policy.max_delete:
+            log("Deleting {0} of {1} old commits in this run".format(self.policy.max_delete, len(delete)))
+            # The rest keep their objects until a later run
+            keep.update(delete[self.policy.max_delete:])
+            delete = delete[:self.policy.max_delete]
+        return (keep, delete)
+
+    def _delete(self, objtype, checksum):
+        _,size = self.repo.query_object_storage_size(objtype, checksum, None)
+        if not self.dry_run:
+            self.repo.delete_object(objtype, checksum, None)
+        return size
+
+    def run(self):
+        """Returns the number of bytes reclaimed."""
+        with repo_lock(self.repo_path, exclusive=True):
+            return self._run()
+
+    def _run(self):
+        keep, delete = self.plan()
+        if not delete:
+            log("No commits to delete in {0}".format(self.repo_path))
+            return 0
+        freed = 0
+        for checksum in delete:
+            log("Deleting commit {0}".format(checksum))
+            freed += self._delete(OSTree.ObjectType.COMMIT, checksum)
+        if not self.dry_run:
+            VersionIndex(self.repo_path, self.repo).forget(delete)
+
+        reachable = ReachableObjects(self.repo_path, self.repo).reachable(keep)
+        _,objects = self.repo.list_objects(OSTree.RepoListObjectsFlags.ALL, None)
+        count = 0
+        deleted = set(delete)
+        for name in objects:
+            checksum, objtype = name.unpack()
+            if objtype in _TREE_OBJECTS:
+                unused = (checksum, objtype) not in reachable
+            else:
+                # Detached metadata goes with its commit
+                unused = objtype == OSTree.ObjectType.COMMIT_META and checksum in deleted
+            if unused:
+                freed += self._delete(objtype, checksum)
+                count += 1
+        log("Deleted {0} commits and {1} objects from {2}, {3} reclaimed".format(
+            len(delete), count, self.repo_path, format_size(freed)))
+        return freed
+
+def cache_gc(cachedir, max_size, dry_run=False):
+    """Delete the least recently used packages from the rpm-ostree
+    @cachedir until they total at most @max_size bytes; returns the
+    number of bytes reclaimed."""
+    packages = []
+    total = 0
+    for dirpath, _, filenames in os.walk(cachedir):
+        for name in filenames:
+            if not name.endswith('.rpm'):
+                continue
+            path = os.path.join(dirpath, name)
+            st = os.lstat(path)
+            packages.append((max(st.st_atime, st.st_mtime), st.st_size, path))
+            total += st.st_size
+    packages.sort()
+    freed = 0
+    for _, size, path in packages:
+        if total - freed <= max_size:
+            break
+        if not dry_run:
+            os.unlink(path)
+        freed += size
+    log("Deleted {0} of cached packages from {1}".format(format_size(freed), cachedir))
+    return freed
+
+def main(cmd):
+    parser = argparse.ArgumentParser(description='Delete old commits and cached packages')
+    parser.add_argument('-c', '--config', default=None, help='Take ostree_repo and rpmostree_cache_dir from this config file')
+    parser.add_argument('-p', '--profile', default='DEFAULT', help='Profile of the config file to use')
+    parser.add_argument('--repo', default=None, help='Path to OSTree repository (default: ostree_repo, $OSTREE_REPO or ${pwd}/repo)')
+    parser.add_argument('--cachedir', default=None, help='rpm-ostree cache directory (default: rpmostree_cache_dir)')
+    parser.add_argument('--keep', type=int, default=10, help='Number of commits to keep for each ref')
+    parser.add_argument('--keep-version', action='append', default=[], metavar='PATTERN',
+                        help='Also keep commits whose version matches this pattern (e.g. "*.0"); may be given several times')
+    parser.add_argument('--max-delete', type=int, default=None, help='Delete at most this many commits in this run')
+    parser.add_argument('--max-cache-size', default=None, help='Keep at most this much (e.g. 20G) of cached packages')
+    parser.add_argument('-n', '--dry-run', action='store_true', help="Report what would be reclaimed without deleting anything")
+    args = parser.parse_args()
+
+    repo_path = args.repo
+    cachedir = args.cachedir
+    if args.config is not None:
+        settings = load_config(args.config).profile(args.profile)
+        repo_path = repo_path or settings.get('ostree_repo')
+        cachedir = cachedir or settings.get('rpmostree_cache_dir')
+    if not repo_path:
+        repo_path = os.environ.get('OSTREE_REPO') or os.path.join(os.getcwd(), 'repo')
+    if args.keep < 1:
+        fail_msg("--keep must be at least 1")
+
+    policy = GCPolicy(keep=args.keep, keep_versions=args.keep_version,
+                      max_cache_size=parse_size(args.max_cache_size),
+                      max_delete=args.max_delete)
+    freed = RepoGC(repo_path, policy, dry_run=args.dry_run).run()
+    if cachedir is not None and policy.max_cache_size is not None:
+        if os.path.isdir(cachedir):
+            freed += cache_gc(cachedir, policy.max_cache_size, dry_run=args.dry_run)
+    log("Total reclaimed: {0}{1}".format(format_size(freed), " (dry run)" if args.dry_run else ""))
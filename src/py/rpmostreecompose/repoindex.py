@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# Copyright (C) 2026 The rpm-ostree-toolbox authors
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import threading
+import collections
+import ConfigParser
+
+from .utils import fail_msg
+
+# Parsed .repo files, by path => ((mtime, size), [RepoEntry])
+_parsed = {}
+_parsed_lock = threading.Lock()
+
+class RepoEntry(object):
+    """ One [section] of a yum .repo file. """
+
+    def __init__(self, repoid, path, options):
+        self.id = repoid
+        self.path = path
+        self.options = options
+        self.baseurl = None
+        if 'baseurl' in options:
+            # Only the first of several baseurls
+            self.baseurl = options['baseurl'].split()[0]
+        self.mirrorlist = options.get('mirrorlist')
+        self.enabled = options.get('enabled', '1').strip().lower() in ('1', 'yes', 'true', 'on')
+
+    def text(self, enabled=True):
+        """This repo alone, as .repo file contents."""
+        lines = ['[{0}]'.format(self.id)]
+        for key, value in self.options.iteritems():
+            if key == 'enabled':
+                continue
+            lines.append('{0}={1}'.format(key, value.replace('\n', '\n\t')))
+        lines.append('enabled={0}'.format(1 if enabled else 0))
+        return '\n'.join(lines) + '\n'
+
+def _parse_repofile(path):
+    st = os.stat(path)
+    stamp = (st.st_mtime, st.st_size)
+    with _parsed_lock:
+        cached = _parsed.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    cp = ConfigParser.RawConfigParser()
+    try:
+        cp.read(path)
+    except ConfigParser.Error as e:
+        fail_msg("Error parsing file {0}: {1}".format(os.path.basename(path), e.message))
+    entries = [RepoEntry(section, path, collections.OrderedDict(cp.items(section)))
+               for section in cp.sections()]
+    with _parsed_lock:
+        _parsed[path] = (stamp, entries)
+    return entries
+
+class RepoIndex(object):
+    """ Maps the repo ids defined by the .repo files of a directory to
+    their RepoEntry.  Use repo_index() to get one.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._repos = {}
+        for basename in sorted(os.listdir(directory)):
+            if not basename.endswith('.repo'):
+                continue
+            for entry in _parse_repofile(os.path.join(directory, basename)):
+                self._repos[entry.id] = entry
+
+    def get(self, repoid):
+        return self._repos.get(repoid)
+
+    def require(self, repoid):
+        entry = self._repos.get(repoid)
+        if entry is None:
+            fail_msg("Unable to find repo '{0}' in {1}".format(repoid, self.directory))
+        return entry
+
+    def __contains__(self, repoid):
+        return repoid in self._repos
+
+def repo_index(directory):
+    """Returns the RepoIndex of @directory.  Only .repo files which
+    changed since the last call (by mtime and size) are parsed again."""
+    return RepoIndex(os.path.realpath(directory))
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# Copyright (C) 2026 The rpm-ostree-toolbox authors
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import hashlib
+import StringIO
+import threading
+import urllib2
+import ConfigParser
+
+from .utils import log
+
+# repomd.xml checksums fetched by this process, by URL
+_repomd_memo = {}
+_repomd_lock = threading.Lock()
+
+def expand_repo_vars(url, arch, release):
+    for var, val in [('$basearch', arch), ('$arch', arch), ('$releasever', release)]:
+        if val is not None:
+            url = url.replace(var, val)
+    return url
+
+def parse_repos(text):
+    """Parse the contents of one or more yum .repo files; returns a
+    dict repo id => baseurl (None for mirrorlist-only repos)."""
+    cp = ConfigParser.RawConfigParser()
+    cp.readfp(StringIO.StringIO(text))
+    baseurls = {}
+    for section in cp.sections():
+        baseurl = None
+        if cp.has_option(section, 'baseurl'):
+            # Only the first of several baseurls is used for revisions
+            baseurl = cp.get(section, 'baseurl').split()[0]
+        baseurls[section] = baseurl
+    return baseurls
+
+def repomd_checksum(baseurl, arch=None, release=None):
+    """
+    Identify the current metadata revision of the yum repository at
+    @baseurl by the SHA-256 of its repomd.xml.  Returns None if that
+    can't be determined.  Each URL is only fetched once per process,
+    since several tasks (or profiles) usually share repositories.
+    """
+    if not baseurl:
+        return None
+    url = expand_repo_vars(baseurl, arch, release).rstrip('/') + '/repodata/repomd.xml'
+    with _repomd_lock:
+        if url in _repomd_memo:
+            return _repomd_memo[url]
+    try:
+        data = urllib2.urlopen(url, timeout=60).read()
+    except (urllib2.URLError, IOError, ValueError) as e:
+        log("Unable to fetch {0}: {1}".format(url, e))
+        return None
+    checksum = hashlib.sha256(data).hexdigest()
+    with _repomd_lock:
+        _repomd_memo[url] = checksum
+    return checksum
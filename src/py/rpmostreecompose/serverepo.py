@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# Copyright (C) 2026 The rpm-ostree-toolbox authors
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import signal
+import argparse
+import functools
+import threading
+
+from .utils import fail_msg, log
+from .ostreeutil import repo_lock
+from .webserver import (ADMIT_TIMEOUT, DEFAULT_WORKERS, TemporaryWebserver,
+                        find_repo_server, register_repo_server)
+
+def main(cmd):
+    parser = argparse.ArgumentParser(description='Serve an OSTree repository over http for the image builds')
+    parser.add_argument('--repo', required=True, help='Path to OSTree repository')
+    parser.add_argument('--port', type=int, default=0, help='Port to listen on (default: any free port)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Number of connections served at once')
+    parser.add_argument('--max-connections', type=int, default=None,
+                        help='Serve at most this many connections at once; when all are in use, the '
+                        'longest idle one is closed to make room, and a new connection '
+                        'waiting longer than {0}s for a slot is closed'.format(ADMIT_TIMEOUT))
+    parser.add_argument('--drain-timeout', type=int, default=30,
+                        help='On shutdown, seconds to let open connections finish')
+    args = parser.parse_args()
+
+    if not os.path.isfile(os.path.join(args.repo, 'config')):
+        fail_msg("{0} is not an OSTree repository".format(args.repo))
+    port = find_repo_server(args.repo)
+    if port is not None:
+        fail_msg("{0} is already being served on port {1}".format(args.repo, port))
+
+    # Each request holds the repository's shared lock, so gc waits
+    # for the objects being sent rather than deleting them mid-pull
+    server = TemporaryWebserver(workers=args.workers, max_connections=args.max_connections,
+                                request_lock=functools.partial(repo_lock, args.repo))
+    port = server.start(args.repo, port=args.port)
+    statefile = register_repo_server(args.repo, port)
+    log("Serving {0} on port {1}".format(args.repo, port))
+
+    stopping = threading.Event()
+    def request_stop(signum, frame):
+        stopping.set()
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+    try:
+        while not stopping.is_set():
+            # Event.wait() without a timeout can't be interrupted by signals
+            stopping.wait(3600)
+    finally:
+        # Stop advertising first, so new builds start their own server
+        os.unlink(statefile)
+        log("Shutting down")
+        server.stop(drain_timeout=args.drain_timeout)
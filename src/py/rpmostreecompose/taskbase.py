@@ -23,30 +23,25 @@ import tempfile
 import argparse
 import shutil
 import subprocess
+import threading
 import distutils.spawn
 from gi.repository import Gio, OSTree, GLib  # pylint: disable=no-name-in-module
-import iniparse
-import ConfigParser  # for errors
 from .utils import fail_msg, log, run_sync
+from .config import load_config
+from .treefile import TreefileLoader
+from .checksums import ChecksumSink
+from .fileops import place_tree
+from .repometa import parse_repos, repomd_checksum
+from .repoindex import repo_index
+from .docker_image import DockerImageBuilder
+from .workercache import WorkerImageCache, worker_cache_key, parse_size
 import urlparse
 import urllib2
 
-def _merge_lists(x, y):
-    try:
-        return list(set(x + y))
-    except TypeError:
-        pass # no __hash__, Eg. List of lists
-
-    ret = []
-    for i in x:
-        if i in ret:
-            continue
-        ret.append(i)
-    for i in y:
-        if i in ret:
-            continue
-        ret.append(i)
-    return ret
+# Opened repositories by real path, shared by the profiles composed
+# from one process
+_repos = {}
+_repos_lock = threading.Lock()
 
 class TaskBase(object):
     ATTRS = [ 'workdir', 'rpmostree_cache_dir', 'pkgdatadir',
@@ -61,11 +56,13 @@ class TaskBase(object):
               'local_overrides', 'http_proxy',
               'selinux', 'configdir', 'docker_os_name',
               'vsphere_product_name', 'vsphere_product_vendor_name',
-              'vsphere_product_version', 'vsphere_virtual_system_type'
+              'vsphere_product_version', 'vsphere_virtual_system_type',
+              'worker_cache_max_age', 'worker_cache_max_size',
+              'httpd_max_connections', 'lorax_cache_max_entries'
             ]
 
 
-    def __init__(self, args, cmd, profile=None):
+    def __init__(self, args, cmd, profile=None, separate_workdir=False):
         self.workdir = None
         self.tree_file = None
         self.rpmostree_cache_dir = None
@@ -90,6 +87,10 @@ class TaskBase(object):
         self.selinux = None
         self.configdir = None
         self.docker_os_name = None
+        self.worker_cache_max_age = None
+        self.worker_cache_max_size = None
+        self.httpd_max_connections = None
+        self.lorax_cache_max_entries = None
 
         self._repo = None
         self.args = args
@@ -100,16 +101,12 @@ class TaskBase(object):
                      'pkgdatadir':  os.environ['OSTBUILD_DATADIR'],
                      'yum_baseurl': None,
                      'local_overrides': None,
-                     'selinux': True
+                     'selinux': True,
+                     'worker_cache_max_age': '30',
+                     'lorax_cache_max_entries': '3'
                    }
 
-        if not os.path.isfile(configfile):
-            fail_msg("No config file: " + configfile)
-        settings = iniparse.ConfigParser()
-        try: 
-            settings.read(configfile)
-        except ConfigParser.ParsingError as e:
-            fail_msg("Error parsing your config file {0}: {1}".format(configfile, e.message))            
+        settings = load_config(configfile).profile(profile)
 
         self.outputdir = os.getcwd()
 
@@ -117,7 +114,7 @@ class TaskBase(object):
             fail_msg("Found .git in the current directory; you most likely don't want to build in source directory")
 
         for attr in self.ATTRS:
-            val = self.getConfigValue(attr, settings, profile, defValue=defaults.get(attr))
+            val = settings.get(attr, defaults.get(attr))
             setattr(self, attr, val)
 
         # Checking ostreerepo
@@ -155,6 +152,9 @@ class TaskBase(object):
             self.ostree_repo = self.outputdir + '/repo'
         if not self.ostree_remote:
             self.ostree_remote = self.os_name
+        if self.httpd_max_connections:
+            self.httpd_max_connections = int(self.httpd_max_connections)
+        self.lorax_cache_max_entries = int(self.lorax_cache_max_entries)
         release = self.release
         # Check for configdir in attrs, else fallback to dir holding config
         if self.configdir is None:
@@ -165,6 +165,11 @@ class TaskBase(object):
         else:
             self.tree_file = os.path.join(self.configdir, self.tree_file)
 
+        if 'refresh_workers' in args:
+            self.refresh_workers = args.refresh_workers
+        else:
+            self.refresh_workers = False
+
         # Look for virtnetwork
 
         if 'virtnetwork' in args:
@@ -191,6 +196,11 @@ class TaskBase(object):
         if self.workdir is None:
             self.workdir = tempfile.mkdtemp('.tmp', 'atomic-treecompose')
             self.workdir_is_tmp = True
+        elif separate_workdir:
+            # Several profiles are composed from the same process
+            self.workdir = os.path.join(self.workdir, profile)
+            if not os.path.isdir(self.workdir):
+                os.makedirs(self.workdir)
         self.buildjson()
 
         return
@@ -203,22 +213,6 @@ class TaskBase(object):
         parser.add_argument('--ostreerepo', type=str, required=False, help='Path to OSTree repository (default: ${pwd}/repo)')
         return parser
    
-    def checkini(self, settings, profile, configfile):
-        # If a release is passed via -r and does not exist, error out
-        if profile is not "DEFAULT" and not settings.has_section(profile):
-            sections = settings.sections()
-            fail_msg("Section {0} is not defined in your config file ({1}). Valid sections/profiles are {2}".format(
-                profile, configfile, sections))
-        config_req = ['os_name', 'os_pretty_name',
-                      'tree_name', 'tree_file', 'arch', 'release', 'ref', 'yum_baseurl',
-                      'docker_os_name']
-        missing_confs = []
-        for req in config_req:
-            if not settings.has_option(profile, req):
-                missing_confs.append(req)
-        if len(missing_confs) > 0:
-            fail_msg("The following option(s) {0} are not defined in your configuration file.  Please define them and re-run".format(missing_confs))
-
     def _require_ostree_repo(self, url):
         configurl = url + '/config'
         try:
@@ -227,46 +221,15 @@ class TaskBase(object):
             fail_msg("Unable to find OSTree repository config {0}; Please verify the location and re-run.".format(configurl))
         log("Verified OSTree repository: {0}".format(url))
 
-    def flattenjsoninclude(self, params, includefile):
-        """ This function merges a dict that represents a tree file
-        with a json includefile. It can now handle recursive json
-        files
-        """
-
-        if includefile is not None:
-            includefile = (os.path.dirname(self.tree_file)) + "/" + includefile
-        if not os.path.isfile(includefile):
-            fail_msg(("Your tree file includes another file %s that could not be found") % includefile)
-        else:
-            jsoninclude = open(includefile)
-            incparams = json.load(jsoninclude)
-            if 'include' in incparams:
-                # Found a recursive include
-                next_includefile = incparams.pop('include', None)
-                incparams = self.flattenjsoninclude(incparams, next_includefile)
-            for key in incparams:
-                # If its a str,bool,or list and doesn't exist, add it
-                if (key not in params) and (key != "comment"):
-                    params[key] = incparams[key]
-                # If its a list and already exists, merge them 
-                if key in params and type(incparams[key]) == list:
-                    params[key] = _merge_lists(params[key], incparams[key])
-        return params
-
     def buildjson(self):
         """ This function merges content from the config.ini and
         the json treefile and then outputs a merged, temporary
         json file in tempdir 
         """
 
-        try:
-            json_in = open(self.tree_file)
-        except:
+        if not os.path.isfile(self.tree_file):
             fail_msg("Unable to locate the {0} as described in the config.ini".format(self.tree_file))
-        params = json.load(json_in)
-        if 'include' in params:
-            includefile = params.pop('include')
-            params = self.flattenjsoninclude(params, includefile)
+        params = TreefileLoader().load(self.tree_file)
         if 'ref' not in params:
             params['ref']  = self.ref
         if 'selinux' not in params:
@@ -288,61 +251,65 @@ class TaskBase(object):
 
         treefile_base = os.path.dirname(self.tree_file)
 
-        repo_dict = {}  # map repository names to .repo files
-        for basename in os.listdir(treefile_base):
-            if not basename.endswith('.repo'):
-                continue
-            repo_data = iniparse.ConfigParser()
-            try:
-                repo_data.read(os.path.join(treefile_base, basename))
-            except ConfigParser.Error as e:
-                fail_msg("Error parsing file {0}: {1}".format(basename, e.message))
-            for repo_name in repo_data.sections():
-                repo_dict[repo_name] = basename
+        index = repo_index(treefile_base)
 
         copy_files = {}
         repos = params.get('repos', [])
         for repo_name in repos:
-            try:
-                basename = repo_dict[repo_name]
-            except KeyError:
+            entry = index.get(repo_name)
+            if entry is None:
                 fail_msg("Unable to find repo '%s' as declared in the json input file(s)" % repo_name)
+            basename = os.path.basename(entry.path)
             copy_orig = os.path.join(treefile_base, basename)
             copy_dest = os.path.join(self.workdir, basename)
             copy_files[copy_orig] = copy_dest
 
+        # Everything copied, for the input fingerprint of a compose
+        self.externals = []
+        self.repofiles = []
         for copy_orig, copy_dest in copy_files.items():
             try:
                 shutil.copyfile(copy_orig, copy_dest)
             except:
                 fail_msg("Unable to copy {0} to tempdir".format(copy_orig))
+            self.externals.append(copy_dest)
+            self.repofiles.append(copy_dest)
         post_script = params.get('postprocess-script')
         if post_script is not None:
             shutil.copy2(os.path.join(treefile_base, post_script), self.workdir)
+            self.externals.append(os.path.join(self.workdir, os.path.basename(post_script)))
         for key in ['check-passwd', 'check-groups']:
             check = params.get(key)
             if check and check['type'] == 'file':
                 filename = check['filename']
                 shutil.copy2(os.path.join(treefile_base, filename), self.workdir)
+                self.externals.append(os.path.join(self.workdir, os.path.basename(filename)))
 
     @property
     def repo(self):
-        if not os.path.exists(self.ostree_repo):
-            #  Remove the cache, if the repo. is gone ... or rpm-ostree is very
-            # confused.
-            if (self.rpmostree_cache_dir is not None and
-                os.path.exists(self.rpmostree_cache_dir)):
-                shutil.rmtree(self.rpmostree_cache_dir)
-            os.makedirs(self.ostree_repo)
-            subprocess.check_call(['ostree', 'init',
-                                   "--repo="+self.ostree_repo, '--mode=archive-z2'])
-        if self._repo is None:
-            self._repo = OSTree.Repo(path=Gio.File.new_for_path(self.ostree_repo))
-
-            try:
-                self._repo.open(None)
-            except:
-                fail_msg("The repo location {0} has not been initialized.  Use 'ostree --repo={0} init --mode=archive-z2' to initialize and re-run rpm-ostree-toolbox".format(self.ostree_repo))
+        with _repos_lock:
+            if not os.path.exists(self.ostree_repo):
+                #  Remove the cache, if the repo. is gone ... or rpm-ostree is very
+                # confused.
+                if (self.rpmostree_cache_dir is not None and
+                    os.path.exists(self.rpmostree_cache_dir)):
+                    shutil.rmtree(self.rpmostree_cache_dir)
+                os.makedirs(self.ostree_repo)
+                subprocess.check_call(['ostree', 'init',
+                                       "--repo="+self.ostree_repo, '--mode=archive-z2'])
+                _repos.pop(os.path.realpath(self.ostree_repo), None)
+                self._repo = None
+            if self._repo is None:
+                key = os.path.realpath(self.ostree_repo)
+                repo = _repos.get(key)
+                if repo is None:
+                    repo = OSTree.Repo(path=Gio.File.new_for_path(self.ostree_repo))
+                    try:
+                        repo.open(None)
+                    except:
+                        fail_msg("The repo location {0} has not been initialized.  Use 'ostree --repo={0} init --mode=archive-z2' to initialize and re-run rpm-ostree-toolbox".format(self.ostree_repo))
+                    _repos[key] = repo
+                self._repo = repo
 
         return self._repo
 
@@ -356,13 +323,11 @@ class TaskBase(object):
     def getrepos(self, flatjson):
         fj = open(self.jsonfilename)
         fjparams = json.load(fj)
+        index = repo_index(self.configdir)
         repos = ""
         repoids = []
         for repo in fjparams['repos']:
-            repofile = os.path.join(self.configdir, repo + ".repo")
-            repos = repos + open(repofile).read()
-            repos = repos + "enabled=1"
-            repos = repos + "\n"
+            repos += index.require(repo).text(enabled=True)
             repoids.append(repo)
         if self.lorax_additional_repos:
             for i,repourl in enumerate(self.lorax_additional_repos.split(',')):
@@ -387,20 +352,60 @@ class TaskBase(object):
         with open(self.workdir + '/lorax.repo', 'w') as f:
             f.write(repos)
 
-        docker_builder_argv = ['rpm-ostree-toolbox', 'docker-image',
-                               '--minimize=docs',
-                               '--minimize=langs',
-                               '--reposdir', self.workdir,
-                               '--name', fullname]
-        for r in repoids:
-            docker_builder_argv.append('--enablerepo=' + r)
-
-        docker_builder_argv.extend(packages)
-                               
-        run_sync(docker_builder_argv)
+        minimize = ['docs', 'langs']
+        cache = WorkerImageCache()
+        key = self._workerCacheKey(packages, repos, minimize)
+        if key is not None:
+            fullname += ':' + key[:16]
+            if self.refresh_workers:
+                log("Rebuilding worker image {0} as requested".format(fullname))
+            elif cache.lookup(fullname):
+                log("Reusing cached worker image {0}".format(fullname))
+                return fullname
+
+        builder = DockerImageBuilder(self.workdir, repoids, minimize=minimize)
+        image_id, timings = builder.build(fullname, packages)
+        log("Worker image {0}: yum install {1:.1f}s, import {2:.1f}s".format(
+            fullname, timings.get('install', 0), timings.get('import', 0)))
+
+        if key is not None:
+            cache.add(fullname, image_id)
+        max_age = self.worker_cache_max_age
+        cache.evict(max_age=float(max_age) * 86400 if max_age else None,
+                    max_size=parse_size(self.worker_cache_max_size),
+                    keep=[fullname])
 
         return fullname
 
+    def _workerCacheKey(self, packages, repos, minimize):
+        """
+        Returns the cache key for a worker image built from @packages
+        using the .repo contents @repos, or None if the metadata
+        revision of one of the repos is unknown.
+        """
+        repomd = self.repomdChecksums(repos)
+        if repomd is None:
+            log("Not caching worker image")
+            return None
+        return worker_cache_key(packages, repos, repomd, minimize)
+
+    def repomdChecksums(self, repos, only=None):
+        """
+        Returns a dict repo id => repomd.xml checksum for the repos in
+        the .repo contents @repos (restricted to the ids in @only, if
+        given), or None if the revision of one of them is unknown.
+        """
+        repomd = {}
+        for repoid, baseurl in parse_repos(repos).iteritems():
+            if only is not None and repoid not in only:
+                continue
+            checksum = repomd_checksum(baseurl, self.arch, self.release)
+            if checksum is None:
+                log("Unable to determine metadata revision of repo {0}".format(repoid))
+                return None
+            repomd[repoid] = checksum
+        return repomd
+
     def buildDockerWorker(self, name, packages, dockerfile, contextdir=None):
         """
         Generate a local Docker image using @packages as a base and
@@ -420,29 +425,6 @@ class TaskBase(object):
         run_sync(db_cmd, env=child_env)
         return fullname
 
-    def hasValue(self, configkey, settings, profile):
-        """
-        This is a helper function for getConfigValue() and basically
-        checks the profile of a config.ini and looks to see if the
-        key exists.  If so, it returns the value, else None
-        """
-        configvalue = None
-        if configkey in dict(settings.items(profile)):
-            configvalue = settings.get(profile, configkey)
-        return None if configvalue is None else configvalue
-
-    def getConfigValue(self, configkey, settings, profile, defValue=None):
-        """
-        This function helps to safely extract config.ini values given a key,
-        a ConfigParser object, a profile, and an optional default value. The
-        function will search the profile first for a key/value, then the 
-        default profile.  It will return the value or None if a default 
-        fallback value is not provided
-        """
-        configvalue = self.hasValue(configkey, settings, profile)
-        configvalue = self.hasValue(configkey, settings, "DEFAULT") if configvalue is None else configvalue
-        return defValue if configvalue is None else configvalue
-
     def checkRefExists(self, ref, httpresponse):
         """
         This function determines if the HTTP ostree location has the same
@@ -468,6 +450,8 @@ class ImageTaskBase(TaskBase):
         self.image_workdir = os.path.abspath(args.outputdir) + '/work'
         self.image_content_outputdir = self.image_workdir + '/images'
         self.image_log_outputdir = self.image_workdir + '/logs'
+        # Artifact checksums, fed as the outputs are written
+        self.checksums = ChecksumSink()
 
     @staticmethod
     def all_baseargs():
@@ -476,6 +460,7 @@ class ImageTaskBase(TaskBase):
         parser.add_argument('-o', '--outputdir', type=str, required=True, help='Path to image output directory')
         parser.add_argument('--overwrite', action='store_true', help='If true, replace any existing output')
         parser.add_argument('--preserve-ks-url', action='store_true', help='If true, do not auto-substitute kickstart ostreesetup url') 
+        parser.add_argument('--refresh-workers', action='store_true', help='Rebuild Docker worker images even if a cached one is up to date')
         return [TaskBase.baseargs(), parser]
 
     def impl_create(self, **kwargs):
@@ -500,9 +485,9 @@ class ImageTaskBase(TaskBase):
         its final location.
 
         """
-        run_sync(['/bin/sh', '-c', 'find .  -type f | grep -v \'.*SUMS$\' | xargs sha256sum'], cwd=self.image_content_outputdir,
-                 stdout=open(self.image_content_outputdir + '/SHA256SUMS', 'w'))
-        shutil.move(self.image_content_outputdir, self.args.outputdir)
-        shutil.move(self.image_log_outputdir, self.args.outputdir)
+        self.checksums.write_sums(self.image_content_outputdir,
+                                  self.image_content_outputdir + '/SHA256SUMS')
+        place_tree(self.image_content_outputdir, self.args.outputdir)
+        place_tree(self.image_log_outputdir, self.args.outputdir)
         shutil.rmtree(self.image_workdir)
         log("Complete!  Images/ and logs/ written to {0}".format(self.args.outputdir))
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# Copyright (C) 2026 The rpm-ostree-toolbox authors
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import sys
+import time
+import threading
+import traceback
+import multiprocessing
+
+from .utils import log
+
+PENDING = 'pending'
+RUNNING = 'running'
+COMPLETE = 'complete'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+def default_workers():
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+class GraphNode(object):
+    def __init__(self, name, func, deps, after):
+        self.name = name
+        self.func = func
+        self.deps = deps
+        self.after = after
+        self.state = PENDING
+        self.result = None
+        self.error = None
+        self.elapsed = None
+
+class TaskGraph(object):
+    """ Runs a set of named callables respecting their dependencies,
+    with at most @workers of them in flight at once.  Each callable
+    is passed the results of its dependencies, in order.  A failing
+    node only takes down the nodes that depend on it; everything
+    else still runs to completion.  Nodes listed in @after are only
+    waited for, whatever their outcome, and pass no result.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = max(1, workers or default_workers())
+        self._nodes = {}
+        self._order = []
+        self._lock = threading.Condition()
+
+    def add(self, name, func, deps=[], after=[]):
+        if name in self._nodes:
+            raise ValueError("Duplicate task: " + name)
+        for dep in list(deps) + list(after):
+            if dep not in self._nodes:
+                raise ValueError("Task {0} depends on unknown task {1}".format(name, dep))
+        self._nodes[name] = GraphNode(name, func, list(deps), list(after))
+        self._order.append(name)
+
+    def result(self, name):
+        return self._nodes[name].result
+
+    def _runnable(self):
+        for name in self._order:
+            node = self._nodes[name]
+            if node.state != PENDING:
+                continue
+            depstates = [self._nodes[d].state for d in node.deps]
+            if any(s in (FAILED, SKIPPED) for s in depstates):
+                node.state = SKIPPED
+                log("Skipping {0}: a dependency failed".format(name))
+                continue
+            if not all(s == COMPLETE for s in depstates):
+                continue
+            if all(self._nodes[a].state in (COMPLETE, FAILED, SKIPPED) for a in node.after):
+                return node
+        return None
+
+    def _execute(self, node):
+        args = [self._nodes[d].result for d in node.deps]
+        start = time.time()
+        try:
+            result = node.func(*args)
+            error = None
+        # fail_msg() and friends exit; treat that as a node failure too
+        except (Exception, SystemExit) as e:
+            traceback.print_exc(file=sys.stderr)
+            result = None
+            error = e
+        with self._lock:
+            node.elapsed = time.time() - start
+            node.result = result
+            node.error = error
+            node.state = FAILED if error is not None else COMPLETE
+            if error is not None:
+                log("Task {0} failed after {1:.1f}s: {2}".format(node.name, node.elapsed, error))
+            else:
+                log("Task {0} completed in {1:.1f}s".format(node.name, node.elapsed))
+            self._lock.notify_all()
+
+    def run(self):
+        """Execute every node; returns the names of the nodes that
+        failed or were skipped."""
+        threads = []
+        with self._lock:
+            while True:
+                running = sum(1 for n in self._nodes.values() if n.state == RUNNING)
+                node = None
+                if running < self.workers:
+                    node = self._runnable()
+                if node is not None:
+                    node.state = RUNNING
+                    t = threading.Thread(target=self._execute, args=(node,),
+                                         name=node.name)
+                    t.daemon = True
+                    threads.append(t)
+                    t.start()
+                    continue
+                if running == 0:
+                    break
+                self._lock.wait()
+        for t in threads:
+            t.join()
+        return [n for n in self._order
+                if self._nodes[n].state in (FAILED, SKIPPED)]
+
+    def state(self, name):
+        return self._nodes[name].state
+
+    def elapsed(self, name):
+        return self._nodes[name].elapsed
+
+    def log_summary(self, title):
+        log(title)
+        for name in self._order:
+            node = self._nodes[name]
+            if node.elapsed is None:
+                log("  {0:<24} {1}".format(name, node.state))
+            else:
+                log("  {0:<24} {1:<9} {2:8.1f}s".format(name, node.state, node.elapsed))
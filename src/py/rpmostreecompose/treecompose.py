@@ -19,19 +19,27 @@
 import json
 import os
 import sys
+import hashlib
 import tempfile
 import argparse
 import shutil
 import subprocess
 import distutils.spawn
 from gi.repository import Gio, OSTree, GLib  # pylint: disable=no-name-in-module
-import iniparse
 
 from .taskbase import TaskBase
+from .taskgraph import TaskGraph, COMPLETE
+from .config import load_config
+from .commitdiff import CommitDiff
+from .deltas import update_static_deltas
+from .versionindex import VersionIndex
+from .ostreeutil import repo_lock
 from .utils import run_sync, fail_msg, log
 
 
-def _rev2version(repo, rev):
+INPUTHASH_KEY = 'rpm-ostree-toolbox.inputhash'
+
+def _rev2metadata(repo, rev, key):
     _,oldrev = repo.resolve_rev(rev, True)
     if oldrev is None:
         return None
@@ -39,13 +47,36 @@ def _rev2version(repo, rev):
     _,commit = repo.load_variant(OSTree.ObjectType.COMMIT, oldrev)
 
     metadata = commit.get_child_value(0)
-    version = metadata.lookup_value("version", None)
-    if version is not None:
-        version = version.get_string()
-    return version
+    value = metadata.lookup_value(key, None)
+    if value is not None:
+        value = value.get_string()
+    return value
 
 class Treecompose(TaskBase):
-    def compose_tree(self):
+    def input_fingerprint(self):
+        """
+        Hash of everything a compose depends on: the flattened treefile,
+        the files it references and the metadata revision of each of its
+        repos.  Returns None if a repo revision can't be determined.
+        """
+        with open(self.jsonfilename) as f:
+            params = json.load(f)
+        repos = ''
+        for path in sorted(self.repofiles):
+            with open(path) as f:
+                repos += f.read() + '\n'
+        repomd = self.repomdChecksums(repos, only=params.get('repos', []))
+        if repomd is None:
+            return None
+        h = hashlib.sha256()
+        for path in [self.jsonfilename] + sorted(self.externals):
+            with open(path) as f:
+                h.update('{0}\0{1}\0'.format(os.path.basename(path),
+                                              hashlib.sha256(f.read()).hexdigest()))
+        h.update(json.dumps(repomd, sort_keys=True))
+        return h.hexdigest()
+
+    def compose_tree(self, force=False):
         # XXX: rpm-ostree should be handling this, I think
         _,origrev = self.repo.resolve_rev(self.ref, True)
         if not self.tree_file:
@@ -53,7 +84,19 @@ class Treecompose(TaskBase):
                                                 self.tree_name)
         rpmostreecmd = ['rpm-ostree', 'compose', 'tree', '--repo=' + self.ostree_repo]
 
-        loaded_version = _rev2version(self.repo, self.ref)
+        inputhash = self.input_fingerprint()
+        if inputhash is not None:
+            if (not force and origrev is not None and
+                _rev2metadata(self.repo, self.ref, INPUTHASH_KEY) == inputhash):
+                log("Inputs unchanged since {0}; skipping compose".format(origrev))
+                return (origrev, origrev)
+            rpmostreecmd.append('--add-metadata-string={0}={1}'.format(INPUTHASH_KEY, inputhash))
+
+        versions = VersionIndex(self.ostree_repo, self.repo)
+        versions.update(self.ref)
+        loaded_version = None
+        if origrev is not None:
+            loaded_version = versions.version(self.ref, origrev)
 
         # Load the old version from the tree...
         if self.tree_version and self.tree_version.startswith('skip-or-'):
@@ -136,23 +179,141 @@ class Treecompose(TaskBase):
                 os.makedirs(rpmostreecachedir)
         rpmostreecmd.append(self.jsonfilename)
 
-        subprocess.check_call(rpmostreecmd)
+        with repo_lock(self.ostree_repo):
+            subprocess.check_call(rpmostreecmd)
         _,newrev = self.repo.resolve_rev(self.ref, True)
+        versions.update(self.ref)
         return (origrev, newrev)
 
+    def diff(self, origrev, newrev, output=None):
+        """Log what changed between @origrev and @newrev, and write
+        the details as JSON lines to @output if given."""
+        if origrev is None or origrev == newrev:
+            return
+        diff = CommitDiff(self.repo, origrev, newrev)
+        diff.log_summary()
+        if output is not None:
+            diff.write_json(output)
+            log("Wrote " + output)
+
 ## End Composer
 
+def _compose(composer, args, profile=None):
+    origrev, newrev = composer.compose_tree(force=args.force)
+    if args.diff or args.diff_file:
+        output = args.diff_file
+        if output is not None and profile is not None:
+            output = '{0}.{1}'.format(output, profile)
+        composer.diff(origrev, newrev, output=output)
+    return (origrev, newrev)
+
+def _update_deltas(args, composers):
+    """Update the static deltas and summary of each repository the
+    @composers committed to, once all of them are done."""
+    repos = {}
+    for composer in composers:
+        repos.setdefault(composer.ostree_repo, []).append(composer)
+    for path in sorted(repos):
+        update_static_deltas(path, repos[path][0].repo, [c.ref for c in repos[path]],
+                             args.static_deltas, workers=args.delta_workers)
+
+def _compose_group(composer):
+    """ Profiles which would share rpm-ostree's cachedir and repo
+    metadata; they are composed one after the other, in order, so
+    each metadata download serves the following ones.
+    """
+    return (composer.rpmostree_cache_dir or '', composer.arch, composer.release,
+            sorted(os.path.basename(r) for r in composer.repofiles))
+
+def compose_profiles(args, cmd, profiles):
+    """
+    Compose several profiles from one process, up to args.parallel at
+    a time.  A failing profile doesn't stop the others.
+    """
+    composers = {}
+    for profile in profiles:
+        try:
+            composer = Treecompose(args, cmd, profile=profile, separate_workdir=True)
+        except SystemExit:
+            log("Unable to load profile {0}".format(profile))
+            continue
+        composer.tree_version = args.versioning
+        composers[profile] = composer
+
+    graph = TaskGraph(workers=args.parallel)
+    # rpm-ostree can't use one cachedir from concurrent composes
+    previous = {}
+    for profile in sorted(composers, key=lambda p: _compose_group(composers[p])):
+        composer = composers[profile]
+        cachedir = composer.rpmostree_cache_dir
+        after = [previous[cachedir]] if cachedir in previous else []
+        graph.add(profile, lambda c=composer, p=profile: _compose(c, args, p), after=after)
+        if cachedir is not None:
+            previous[cachedir] = profile
+    graph.run()
+
+    if args.static_deltas is not None:
+        _update_deltas(args, [composers[p] for p in composers
+                              if graph.state(p) == COMPLETE])
+
+    failed = []
+    log("Compose summary:")
+    for profile in profiles:
+        if profile not in composers:
+            log("  {0:<24} {1}".format(profile, 'failed to load'))
+            failed.append(profile)
+            continue
+        elapsed = graph.elapsed(profile) or 0
+        if graph.state(profile) != COMPLETE:
+            log("  {0:<24} {1:<9} {2:8.1f}s".format(profile, graph.state(profile), elapsed))
+            failed.append(profile)
+            continue
+        origrev, newrev = graph.result(profile)
+        if origrev != newrev:
+            change = "{0} => {1}".format(origrev, newrev)
+        else:
+            change = "unchanged at {0}".format(origrev)
+        log("  {0:<24} {1:<9} {2:8.1f}s  {3}: {4}".format(profile, COMPLETE, elapsed,
+                                                          composers[profile].ref, change))
+
+    for composer in composers.values():
+        composer.cleanup()
+    if failed:
+        fail_msg("Failed to compose: " + ", ".join(failed))
+
 def main(cmd):
     parser = argparse.ArgumentParser(description='Compose OSTree tree',
                                      parents=[TaskBase.baseargs()])
-    parser.add_argument('-p', '--profile', type=str, default='DEFAULT', help='Profile to compose (references a stanza in the config file)')
+    parser.add_argument('-p', '--profile', type=str, default='DEFAULT', help='Profile to compose (references a stanza in the config file); several may be given, separated by commas')
+    parser.add_argument('--all-profiles', action='store_true', help='Compose every profile of the config file')
+    parser.add_argument('--parallel', type=int, default=1, help='Compose up to this many profiles at once')
     parser.add_argument('-V', '--versioning', type=str, default='skip-or-refresh', help='Version to mark compose')
     parser.add_argument('-v', '--verbose', action='store_true', help='verbose output')
+    parser.add_argument('--force', action='store_true', help='Compose even if the inputs are unchanged since the last commit')
+    parser.add_argument('--diff', action='store_true', help='Report what changed since the previous commit')
+    parser.add_argument('--static-deltas', type=int, default=None, metavar='N',
+                        help='After composing, generate static deltas from the N previous commits, delete deltas to commits which are no longer a ref tip, and update the summary file (0 only updates the summary)')
+    parser.add_argument('--delta-workers', type=int, default=1, help='Generate up to this many static deltas at once')
+    parser.add_argument('--diff-file', help='Write the changes since the previous commit as JSON lines to this file (suffixed by the profile name with several profiles)')
     args = parser.parse_args()
-    composer = Treecompose(args, cmd, profile=args.profile)
+
+    if args.all_profiles:
+        # A config with only a [DEFAULT] stanza has a single profile
+        profiles = load_config(args.config).sections() or ['DEFAULT']
+    else:
+        profiles = [p.strip() for p in args.profile.split(',') if p.strip()]
+    if not profiles:
+        fail_msg("No profiles to compose in {0}".format(args.config))
+    if len(profiles) != 1 or args.all_profiles:
+        compose_profiles(args, cmd, profiles)
+        return
+
+    composer = Treecompose(args, cmd, profile=profiles[0])
     composer.tree_version = args.versioning
     composer.show_config()
-    origrev, newrev = composer.compose_tree()
+    origrev, newrev = _compose(composer, args)
+    if args.static_deltas is not None:
+        _update_deltas(args, [composer])
 
     if origrev != newrev:
         log("%s => %s" % (composer.ref, newrev))
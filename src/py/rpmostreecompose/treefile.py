@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# Copyright (C) 2026 The rpm-ostree-toolbox authors
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import json
+import hashlib
+import threading
+
+from .utils import STATEDIR, fail_msg
+
+# Flattened treefiles of this process, by top-level path
+_memo = {}
+_memo_lock = threading.Lock()
+
+def _hashable(item):
+    try:
+        hash(item)
+        return item
+    except TypeError:
+        # Eg. lists of lists
+        return json.dumps(item, sort_keys=True)
+
+def merge_lists(x, y):
+    """Items of @x then @y, without duplicates, keeping the order in
+    which they first appear."""
+    seen = set()
+    ret = []
+    for i in x + y:
+        key = _hashable(i)
+        if key in seen:
+            continue
+        seen.add(key)
+        ret.append(i)
+    return ret
+
+def _hash_file(path):
+    with open(path) as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+class TreefileLoader(object):
+    """ Flattens a treefile and everything it (transitively) includes.
+    Includes may be a file name or a list of them, and are resolved
+    relative to the directory of the top-level treefile.  Keys of the
+    including file win, except lists, which are merged.
+
+    Each file of the include graph is parsed and flattened once, and the
+    result is cached in the toolbox state directory, keyed by the
+    content hash of every file in the graph.
+    """
+
+    def __init__(self, statedir=STATEDIR):
+        self._cachedir = os.path.join(statedir, 'treefile-cache')
+
+    def _cachepath(self, treefile):
+        key = hashlib.sha256(os.path.realpath(treefile)).hexdigest()
+        return os.path.join(self._cachedir, key + '.json')
+
+    def _cached(self, treefile, entry):
+        """Returns the flattened treefile in @entry, if none of the files
+        it was built from changed."""
+        if entry is None:
+            return None
+        for path, digest in entry['files'].iteritems():
+            if not os.path.isfile(path) or _hash_file(path) != digest:
+                return None
+        return entry['params']
+
+    def load(self, treefile):
+        treefile = os.path.abspath(treefile)
+        with _memo_lock:
+            entry = _memo.get(treefile)
+        params = self._cached(treefile, entry)
+        if params is not None:
+            return json.loads(json.dumps(params))
+
+        cachepath = self._cachepath(treefile)
+        try:
+            with open(cachepath) as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            entry = None
+        params = self._cached(treefile, entry)
+
+        if params is None:
+            files = {}
+            params = self._flatten(treefile, os.path.dirname(treefile), [treefile], files, {})
+            entry = { 'files': files, 'params': params }
+            try:
+                if not os.path.isdir(self._cachedir):
+                    os.makedirs(self._cachedir)
+                tmp = '{0}.{1}.tmp'.format(cachepath, os.getpid())
+                with open(tmp, 'w') as f:
+                    json.dump(entry, f)
+                os.rename(tmp, cachepath)
+            except (IOError, OSError):
+                # Only an optimization
+                pass
+        with _memo_lock:
+            _memo[treefile] = entry
+        # Callers modify the result
+        return json.loads(json.dumps(params))
+
+    def _flatten(self, path, basedir, stack, files, done):
+        if path in done:
+            return done[path]
+        with open(path) as f:
+            data = f.read()
+        files[path] = hashlib.sha256(data).hexdigest()
+        try:
+            params = json.loads(data)
+        except ValueError as e:
+            fail_msg("Unable to parse treefile {0}: {1}".format(path, e))
+
+        includes = params.pop('include', None)
+        if includes is None:
+            includes = []
+        elif not isinstance(includes, list):
+            includes = [includes]
+        for include in includes:
+            incpath = os.path.join(basedir, include)
+            if not os.path.isfile(incpath):
+                fail_msg(("Your tree file includes another file %s that could not be found") % incpath)
+            if incpath in stack:
+                fail_msg("Treefile include cycle: " + " -> ".join(stack + [incpath]))
+            incparams = self._flatten(incpath, basedir, stack + [incpath], files, done)
+            for key, value in incparams.iteritems():
+                if key not in params:
+                    if key == "comment":
+                        continue
+                    params[key] = merge_lists(value, []) if isinstance(value, list) else value
+                elif isinstance(value, list) and isinstance(params[key], list):
+                    params[key] = merge_lists(params[key], value)
+        done[path] = params
+        return params
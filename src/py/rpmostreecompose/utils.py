@@ -19,15 +19,12 @@
 
 import sys
 import subprocess
-import posixpath
-import urllib
-from SimpleHTTPServer import SimpleHTTPRequestHandler
-import SocketServer
-import threading
 import os
-import signal
-import ctypes
-import urllib2
+
+# Persistent state (caches, indexes) shared between invocations
+STATEDIR = os.environ.get('RPM_OSTREE_TOOLBOX_STATEDIR', '/var/lib/rpm-ostree-toolbox')
+# Runtime state, such as the shared repo servers
+RUNDIR = os.environ.get('RPM_OSTREE_TOOLBOX_RUNDIR', '/run/rpm-ostree-toolbox')
 
 def fail_msg(msg):
     if False:
@@ -45,44 +42,3 @@ def log(msg):
     sys.stdout.write(msg)
     sys.stdout.write('\n')
     sys.stdout.flush()
-
-class ThreadedTCPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
-    pass
-
-class RequestHandler(SimpleHTTPRequestHandler):
-    def translate_path(self, path):
-        # Copy of python's, but using server._cwd instead of os.getcwd()
-        # abandon query parameters
-        path = path.split('?',1)[0]
-        path = path.split('#',1)[0]
-        # Don't forget explicit trailing slash when normalizing. Issue17324
-        trailing_slash = path.rstrip().endswith('/')
-        path = posixpath.normpath(urllib.unquote(path))
-        words = path.split('/')
-        words = filter(None, words)
-        path = self.server._cwd  # HACKED HERE
-        for word in words:
-            if os.path.dirname(word) or word in (os.curdir, os.pardir):
-                # Ignore components that are not a simple file/directory name
-                continue
-            path = os.path.join(path, word)
-        if trailing_slash:
-            path += '/'
-        return path
-
-class TemporaryWebserver(object):
-    """ This class is used to control a temporary webserver which is used
-    by the installer and imagefactory rpm-ostree-toolbox subcommands to get
-    content from the from the host to the builds
-    """
-
-    def start(self, repopath):
-        self.httpd = SocketServer.ThreadingTCPServer(("", 0), RequestHandler)
-        self.httpd._cwd = repopath
-        server_thread = threading.Thread(target=self.httpd.serve_forever)
-        server_thread.daemon = True
-        server_thread.start()
-        return self.httpd.server_address[1]
-
-    def stop(self):
-        del self.httpd
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# Copyright (C) 2026 The rpm-ostree-toolbox authors
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import sys
+import time
+import argparse
+import sqlite3
+import contextlib
+
+from gi.repository import OSTree  # pylint: disable=no-name-in-module
+
+from .utils import STATEDIR, fail_msg
+from .ostreeutil import open_repo, repo_key, commit_info
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS commits (ref TEXT NOT NULL, checksum TEXT NOT NULL,
+                                    version TEXT, timestamp INTEGER NOT NULL,
+                                    PRIMARY KEY (ref, checksum));
+CREATE INDEX IF NOT EXISTS commits_by_version ON commits (version);
+CREATE INDEX IF NOT EXISTS commits_by_time ON commits (ref, timestamp);
+CREATE TABLE IF NOT EXISTS refs (ref TEXT PRIMARY KEY, tip TEXT NOT NULL);
+"""
+
+class VersionIndex(object):
+    """ A persistent index of the (ref, version, checksum, timestamp)
+    of the commits of an OSTree repository, kept in the toolbox state
+    directory.  update() only reads the commits added to a ref since
+    the last time it was indexed; queries go through SQLite indexes
+    instead of loading commit objects.
+    """
+
+    def __init__(self, repo_path, repo=None, statedir=STATEDIR):
+        self.repo_path = repo_path
+        self.repo = repo if repo is not None else open_repo(repo_path)
+        dbdir = os.path.join(statedir, 'version-index')
+        if not os.path.isdir(dbdir):
+            os.makedirs(dbdir)
+        self.path = os.path.join(dbdir, repo_key(repo_path) + '.db')
+        with self._connect() as db:
+            db.executescript(_SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # One connection per call, so several composes may share this
+        db = sqlite3.connect(self.path, timeout=60)
+        db.text_factory = str
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def _drop_ref(self, db, ref):
+        db.execute("DELETE FROM commits WHERE ref = ?", (ref,))
+        db.execute("DELETE FROM refs WHERE ref = ?", (ref,))
+
+    def update(self, ref):
+        """Index the commits of @ref up to the previously indexed tip;
+        returns the number of commits added.  If that tip isn't an
+        ancestor of the current one (the ref was reset), the history
+        of @ref is indexed again from scratch."""
+        _,tip = self.repo.resolve_rev(ref, True)
+        with self._connect() as db:
+            if tip is None:
+                self._drop_ref(db, ref)
+                return 0
+            row = db.execute("SELECT tip FROM refs WHERE ref = ?", (ref,)).fetchone()
+            old_tip = row[0] if row is not None else None
+            if old_tip == tip:
+                return 0
+            rows = []
+            commit = tip
+            while commit is not None and commit != old_tip:
+                _,variant = self.repo.load_variant_if_exists(OSTree.ObjectType.COMMIT, commit)
+                if variant is None:
+                    break
+                timestamp, version, parent = commit_info(self.repo, commit)
+                rows.append((ref, commit, version, timestamp))
+                commit = parent
+            if commit != old_tip:
+                self._drop_ref(db, ref)
+            db.executemany("INSERT OR REPLACE INTO commits VALUES (?, ?, ?, ?)", rows)
+            db.execute("INSERT OR REPLACE INTO refs VALUES (?, ?)", (ref, tip))
+        return len(rows)
+
+    def forget(self, checksums):
+        """Drop the commits @checksums, which were deleted."""
+        with self._connect() as db:
+            db.executemany("DELETE FROM commits WHERE checksum = ?",
+                           [(checksum,) for checksum in checksums])
+
+    def update_all(self):
+        _,refs = self.repo.list_refs(None, None)
+        with self._connect() as db:
+            for ref in set(self.refs()) - set(refs):
+                self._drop_ref(db, ref)
+        added = 0
+        for ref in sorted(refs):
+            added += self.update(ref)
+        return added
+
+    def version(self, ref, checksum):
+        """The version of the commit @checksum of @ref, if indexed."""
+        with self._connect() as db:
+            row = db.execute("SELECT version FROM commits WHERE ref = ? AND checksum = ?",
+                             (ref, checksum)).fetchone()
+        return row[0] if row is not None else None
+
+    def find(self, version, ref=None):
+        """Returns [(ref, checksum, timestamp)] of the commits with
+        @version, newest first."""
+        query = "SELECT ref, checksum, timestamp FROM commits WHERE version = ?"
+        params = [version]
+        if ref is not None:
+            query += " AND ref = ?"
+            params.append(ref)
+        with self._connect() as db:
+            return db.execute(query + " ORDER BY timestamp DESC", params).fetchall()
+
+    def latest(self, ref):
+        """Returns (version, checksum, timestamp) of the newest commit
+        of @ref which has a version, or None; only the history of the
+        current tip of @ref is indexed, see update()."""
+        with self._connect() as db:
+            return db.execute("SELECT version, checksum, timestamp FROM commits "
+                              "WHERE ref = ? AND version IS NOT NULL "
+                              "ORDER BY timestamp DESC LIMIT 1", (ref,)).fetchone()
+
+    def refs(self):
+        with self._connect() as db:
+            return [row[0] for row in db.execute("SELECT ref FROM refs ORDER BY ref")]
+
+    def history(self, ref, limit=None):
+        """Returns [(version, checksum, timestamp)] of @ref, newest first."""
+        query = "SELECT version, checksum, timestamp FROM commits WHERE ref = ? ORDER BY timestamp DESC"
+        params = [ref]
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self._connect() as db:
+            return db.execute(query, params).fetchall()
+
+def _format_row(ref, version, checksum, timestamp):
+    return '\t'.join([ref, version or '-', checksum,
+                      time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(timestamp))])
+
+def main(cmd):
+    parser = argparse.ArgumentParser(description='Query the versions of the commits of an OSTree repository')
+    parser.add_argument('--repo', default=os.path.join(os.getcwd(), 'repo'), help='Path to OSTree repository (default: ${pwd}/repo)')
+    parser.add_argument('--ref', default=None, help='Only look at this ref')
+    parser.add_argument('--find', metavar='VERSION', default=None, help='List the commits with this version')
+    parser.add_argument('--history', action='store_true', help='List every commit of the ref, newest first')
+    parser.add_argument('-n', '--limit', type=int, default=None, help='List at most this many commits with --history')
+    args = parser.parse_args()
+
+    index = VersionIndex(args.repo)
+    if args.ref is not None:
+        index.update(args.ref)
+    else:
+        index.update_all()
+
+    out = []
+    if args.find is not None:
+        for ref, checksum, timestamp in index.find(args.find, ref=args.ref):
+            out.append(_format_row(ref, args.find, checksum, timestamp))
+        if not out:
+            fail_msg("No commit has version " + args.find)
+    elif args.history:
+        if args.ref is None:
+            fail_msg("--history requires --ref")
+        for version, checksum, timestamp in index.history(args.ref, limit=args.limit):
+            out.append(_format_row(args.ref, version, checksum, timestamp))
+    else:
+        for ref in ([args.ref] if args.ref is not None else index.refs()):
+            latest = index.latest(ref)
+            if latest is not None:
+                out.append(_format_row(ref, *latest))
+    for line in out:
+        sys.stdout.write(line + '\n')
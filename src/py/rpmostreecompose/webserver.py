@@ -0,0 +1,453 @@
+#!/usr/bin/env python
+# Copyright (C) 2014 Colin Walters <walters@verbum.org>
+# Copyright (C) 2026 The rpm-ostree-toolbox authors
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import sys
+import re
+import json
+import time
+import errno
+import Queue
+import hashlib
+import select
+import socket
+import urllib
+import posixpath
+import threading
+import contextlib
+import SocketServer
+from SimpleHTTPServer import SimpleHTTPRequestHandler
+
+from .utils import RUNDIR, log
+from .fileops import sendfile
+
+DEFAULT_WORKERS = 32
+# Seconds a new connection waits for a free slot before it is refused
+ADMIT_TIMEOUT = 10
+
+_range_re = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+@contextlib.contextmanager
+def _no_lock():
+    yield
+
+class ServerStats(object):
+    def __init__(self):
+        self.started = time.time()
+        self.bytes = 0
+        self.objects = 0
+        self._lock = threading.Lock()
+
+    def add(self, nbytes):
+        with self._lock:
+            self.bytes += nbytes
+            self.objects += 1
+
+    def report(self):
+        elapsed = max(time.time() - self.started, 0.001)
+        return ("served {0} objects, {1} bytes in {2:.1f}s ({3:.1f} objects/s, {4:.1f} MB/s)"
+                .format(self.objects, self.bytes, elapsed, self.objects / elapsed,
+                        self.bytes / elapsed / (1024 * 1024)))
+
+class RequestHandler(SimpleHTTPRequestHandler):
+    """ Serves files with keep-alive, single byte ranges and
+    sendfile(); directories are handled by SimpleHTTPRequestHandler.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    # Drop idle keep-alive connections so they don't hold a worker
+    timeout = 30
+
+    def translate_path(self, path):
+        # Copy of python's, but using server._cwd instead of os.getcwd()
+        # abandon query parameters
+        path = path.split('?',1)[0]
+        path = path.split('#',1)[0]
+        # Don't forget explicit trailing slash when normalizing. Issue17324
+        trailing_slash = path.rstrip().endswith('/')
+        path = posixpath.normpath(urllib.unquote(path))
+        words = path.split('/')
+        words = filter(None, words)
+        path = self.server._cwd  # HACKED HERE
+        for word in words:
+            if os.path.dirname(word) or word in (os.curdir, os.pardir):
+                # Ignore components that are not a simple file/directory name
+                continue
+            path = os.path.join(path, word)
+        if trailing_slash:
+            path += '/'
+        return path
+
+    def log_request(self, code='-', size='-'):
+        # Thousands of objects get pulled; only errors are interesting
+        pass
+
+    def log_error(self, format, *args):
+        # Idle keep-alive connections timing out are expected
+        if format.startswith('Request timed out'):
+            return
+        SimpleHTTPRequestHandler.log_error(self, format, *args)
+
+    def handle(self):
+        self.close_connection = 1
+        self.handle_one_request()
+        while not self.close_connection:
+            if not self.server.set_idle(self.connection):
+                # Draining; don't wait for another request
+                return
+            self.handle_one_request()
+
+    def parse_request(self):
+        # We have a request line, so this connection isn't idle any more
+        self.server.set_busy(self.connection)
+        return SimpleHTTPRequestHandler.parse_request(self)
+
+    def do_GET(self):
+        with self.server.request_lock():
+            self._serve(True)
+
+    def do_HEAD(self):
+        with self.server.request_lock():
+            self._serve(False)
+
+    def _parse_range(self, size):
+        """Returns (start, end) for a satisfiable single-range request,
+        None to send everything, or False if unsatisfiable."""
+        header = self.headers.get('Range')
+        if header is None:
+            return None
+        m = _range_re.match(header.strip())
+        if m is None or (m.group(1) == '' and m.group(2) == ''):
+            # Multiple ranges or garbage; just send the whole thing
+            return None
+        if m.group(1) == '':
+            start = max(size - int(m.group(2)), 0)
+            end = size - 1
+        else:
+            start = int(m.group(1))
+            end = int(m.group(2)) if m.group(2) else size - 1
+            end = min(end, size - 1)
+        if start >= size or start > end:
+            return False
+        return (start, end)
+
+    def _serve(self, send_body):
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            # Listings and redirects may not have a Content-Length
+            self.close_connection = 1
+            if send_body:
+                SimpleHTTPRequestHandler.do_GET(self)
+            else:
+                SimpleHTTPRequestHandler.do_HEAD(self)
+            return
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            self.send_error(404, "File not found")
+            return
+        try:
+            size = os.fstat(f.fileno()).st_size
+            byterange = self._parse_range(size)
+            if byterange is False:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{0}'.format(size))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            if byterange is None:
+                start, length = 0, size
+                self.send_response(200)
+            else:
+                start, length = byterange[0], byterange[1] - byterange[0] + 1
+                self.send_response(206)
+                self.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(byterange[0], byterange[1], size))
+            self.send_header('Content-Type', self.guess_type(path))
+            self.send_header('Content-Length', str(length))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('Last-Modified', self.date_time_string(os.fstat(f.fileno()).st_mtime))
+            self.end_headers()
+            if send_body:
+                self.wfile.flush()
+                self._send_file(f, start, length)
+                self.server.stats.add(length)
+        finally:
+            f.close()
+
+    def _send_file(self, f, offset, length):
+        sock = self.connection
+        while length > 0:
+            try:
+                n = sendfile(sock.fileno(), f.fileno(), offset, length)
+            except OSError as e:
+                if e.errno == errno.EAGAIN:
+                    # Python sockets with a timeout are non-blocking
+                    _, writable, _ = select.select([], [sock], [], self.timeout)
+                    if not writable:
+                        raise socket.timeout()
+                    continue
+                if e.errno not in (errno.ENOSYS, errno.EINVAL):
+                    raise
+                f.seek(offset)
+                while length > 0:
+                    buf = f.read(min(length, 1024 * 1024))
+                    if not buf:
+                        break
+                    self.wfile.write(buf)
+                    length -= len(buf)
+                return
+            if n == 0:
+                return
+            offset += n
+            length -= n
+
+class PooledHTTPServer(SocketServer.TCPServer):
+    """ A TCPServer handing connections to a fixed pool of worker
+    threads, optionally capping how many connections are served at
+    once.  Admission happens on the worker, so the accepting thread
+    never blocks: a connection over the cap first has the longest idle
+    keep-alive connection closed to make room, and otherwise waits up
+    to ADMIT_TIMEOUT seconds for a slot before it is closed.
+    """
+
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, address, handler, root, workers=DEFAULT_WORKERS, max_connections=None,
+                 request_lock=_no_lock):
+        SocketServer.TCPServer.__init__(self, address, handler)
+        self._cwd = root
+        # Context manager held while a request is served
+        self.request_lock = request_lock
+        self.stats = ServerStats()
+        self.draining = False
+        # Open connections => since when they have been between
+        # requests, or None while busy
+        self._connections = {}
+        self._connections_lock = threading.Lock()
+        self._queue = Queue.Queue()
+        self._free_slots = max_connections
+        self._slots_cond = threading.Condition(self._connections_lock)
+        self._workers = []
+        for _ in xrange(workers):
+            t = threading.Thread(target=self._worker)
+            t.daemon = True
+            t.start()
+            self._workers.append(t)
+
+    def process_request(self, request, client_address):
+        with self._connections_lock:
+            self._connections[request] = None
+        self._queue.put((request, client_address))
+
+    def _close_longest_idle(self):
+        """Shut down the connection that has been idle the longest, if
+        any; its worker then frees the slot.  Called locked."""
+        idle = [(since, request) for request, since in self._connections.iteritems()
+                if since is not None]
+        if not idle:
+            return
+        _since, request = min(idle)
+        # No longer a candidate, even before its worker notices
+        self._connections[request] = None
+        try:
+            request.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+    def _admit(self):
+        """Take a connection slot, waiting up to ADMIT_TIMEOUT seconds;
+        returns False if none became free."""
+        with self._connections_lock:
+            if self._free_slots is None:
+                return True
+            deadline = time.time() + ADMIT_TIMEOUT
+            while self._free_slots == 0 and not self.draining:
+                self._close_longest_idle()
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._slots_cond.wait(remaining)
+            if self._free_slots == 0 or self.draining:
+                return False
+            self._free_slots -= 1
+            return True
+
+    def set_busy(self, request):
+        with self._connections_lock:
+            self._connections[request] = None
+
+    def set_idle(self, request):
+        """Mark @request as waiting for its next request; returns
+        False if it should be closed instead."""
+        with self._connections_lock:
+            if self.draining:
+                return False
+            self._connections[request] = time.time()
+            if self._free_slots == 0:
+                # A connection waiting for a slot can have this one closed
+                self._slots_cond.notify_all()
+            return True
+
+    def drain(self):
+        """Stop keep-alive: idle connections are closed right away, the
+        others once their current response is sent."""
+        with self._connections_lock:
+            self.draining = True
+            self._slots_cond.notify_all()
+            for request, since in self._connections.items():
+                if since is not None:
+                    try:
+                        request.shutdown(socket.SHUT_RDWR)
+                    except socket.error:
+                        pass
+
+    def handle_error(self, request, client_address):
+        e = sys.exc_info()[1]
+        if isinstance(e, socket.error) and e.errno in (errno.ECONNRESET, errno.EPIPE):
+            # Clients going away mid-connection aren't our problem
+            return
+        SocketServer.TCPServer.handle_error(self, request, client_address)
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            request, client_address = item
+            admitted = self._admit()
+            try:
+                if admitted:
+                    self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                with self._connections_lock:
+                    del self._connections[request]
+                    if admitted and self._free_slots is not None:
+                        self._free_slots += 1
+                        self._slots_cond.notify()
+
+    def stop_workers(self, timeout=None):
+        """Wait up to @timeout seconds for the queued and in-flight
+        connections to be served; returns how many were still open."""
+        for _ in self._workers:
+            self._queue.put(None)
+        deadline = time.time() + timeout if timeout is not None else None
+        for t in self._workers:
+            t.join(None if deadline is None else max(deadline - time.time(), 0))
+        with self._connections_lock:
+            return len(self._connections)
+
+class TemporaryWebserver(object):
+    """ This class is used to control a temporary webserver which is used
+    by the installer and imagefactory rpm-ostree-toolbox subcommands to get
+    content from the from the host to the builds
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, max_connections=None, request_lock=_no_lock):
+        self.workers = workers
+        self.max_connections = max_connections
+        self.request_lock = request_lock
+        self.httpd = None
+        self.port = None
+
+    def start(self, repopath, port=0):
+        self.httpd = PooledHTTPServer(("", port), RequestHandler, repopath,
+                                      workers=self.workers,
+                                      max_connections=self.max_connections,
+                                      request_lock=self.request_lock)
+        server_thread = threading.Thread(target=self.httpd.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+        self.port = self.httpd.server_address[1]
+        return self.port
+
+    def stop(self, drain_timeout=30):
+        """Stop accepting connections, and give the open ones up to
+        @drain_timeout seconds to finish what they are sending."""
+        if self.httpd is None:
+            return
+        # Draining first wakes up the connections waiting for a slot
+        self.httpd.drain()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        remaining = self.httpd.stop_workers(timeout=drain_timeout)
+        if remaining:
+            log("tmp httpd: dropping {0} connections still open".format(remaining))
+        log("tmp httpd " + self.httpd.stats.report())
+        self.httpd = None
+
+class SharedWebserver(object):
+    """ A repo server run by another process ('rpm-ostree-toolbox
+    serve-repo'); stopping it is up to that process.
+    """
+
+    def __init__(self, port):
+        self.port = port
+
+    def stop(self, drain_timeout=None):
+        pass
+
+def _state_path(repopath):
+    key = hashlib.sha256(os.path.realpath(repopath)).hexdigest()[:16]
+    return os.path.join(RUNDIR, 'serve-repo-{0}.json'.format(key))
+
+def register_repo_server(repopath, port):
+    """Advertise a long-lived server for @repopath; returns the path
+    of the state file, to be removed when the server goes away."""
+    if not os.path.isdir(RUNDIR):
+        os.makedirs(RUNDIR)
+    path = _state_path(repopath)
+    tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump({ 'pid': os.getpid(),
+                    'port': port,
+                    'repo': os.path.realpath(repopath) }, f)
+    os.rename(tmp, path)
+    return path
+
+def find_repo_server(repopath):
+    """Returns the port of a running serve-repo for @repopath, or None."""
+    path = _state_path(repopath)
+    try:
+        with open(path) as f:
+            state = json.load(f)
+        if state['repo'] != os.path.realpath(repopath):
+            return None
+        os.kill(state['pid'], 0)
+        socket.create_connection(('127.0.0.1', state['port']), timeout=5).close()
+    except (IOError, OSError, ValueError, KeyError, socket.error):
+        return None
+    return state['port']
+
+def repo_server(repopath, max_connections=None):
+    """
+    Get an http server for the repository at @repopath: a running
+    'rpm-ostree-toolbox serve-repo' if there is one, otherwise a new
+    TemporaryWebserver.  Either way, call stop() when done.
+    """
+    port = find_repo_server(repopath)
+    if port is not None:
+        log("Using shared repo server for {0} on port {1}".format(repopath, port))
+        return SharedWebserver(port)
+    server = TemporaryWebserver(max_connections=max_connections)
+    server.start(repopath)
+    return server
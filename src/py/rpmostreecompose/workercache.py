@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# Copyright (C) 2026 The rpm-ostree-toolbox authors
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import json
+import time
+import fcntl
+import hashlib
+import subprocess
+
+from .utils import STATEDIR, fail_msg, log
+
+SIZE_SUFFIXES = { 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4 }
+
+def parse_size(value):
+    """Parse a size like 4096, 500M or 20G into bytes."""
+    if value is None or value == '':
+        return None
+    value = str(value).strip().upper()
+    mult = SIZE_SUFFIXES.get(value[-1])
+    try:
+        if mult is not None:
+            return int(float(value[:-1]) * mult)
+        return int(value)
+    except ValueError:
+        fail_msg("Invalid size: " + value)
+
+def worker_cache_key(packages, repos, repomd, minimize):
+    """
+    Compute the content address of a worker base image from everything
+    that goes into it: the package list, the flattened .repo contents,
+    the metadata revision of each repo and the minimization flags.
+    """
+    inputs = { 'packages': sorted(packages),
+               'repos': repos,
+               'repomd': repomd,
+               'minimize': sorted(minimize) }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True)).hexdigest()
+
+def _docker_inspect(image, fmt):
+    devnull = open(os.devnull, 'w')
+    try:
+        return subprocess.check_output(['docker', 'inspect', '--format', fmt, image],
+                                       stderr=devnull).strip()
+    except subprocess.CalledProcessError:
+        return None
+    finally:
+        devnull.close()
+
+def _short_id(image_id):
+    # Depending on the Docker version, IDs may have a sha256: prefix
+    return image_id.split(':', 1)[-1]
+
+def docker_image_id(image):
+    """The ID of the Docker image @image, or None if it doesn't exist."""
+    return _docker_inspect(image, '{{.Id}}')
+
+def docker_image_label(image, label):
+    """The value of @label on the Docker image @image, or None if it
+    doesn't exist or isn't labelled."""
+    value = _docker_inspect(image, '{{{{index .Config.Labels "{0}"}}}}'.format(label))
+    if value in ('', '<no value>'):
+        return None
+    return value
+
+class WorkerImageCache(object):
+    """ Tracks the Docker worker base images built by
+    TaskBase.buildDockerWorkerBaseImage(), tagged by their cache key,
+    so they're only rebuilt when one of their inputs changes.
+    """
+
+    def __init__(self, statedir=STATEDIR):
+        self.path = os.path.join(statedir, 'worker-images.json')
+        if not os.path.isdir(statedir):
+            os.makedirs(statedir)
+
+    def _locked(self, func):
+        with open(self.path + '.lock', 'w') as lockf:
+            fcntl.flock(lockf.fileno(), fcntl.LOCK_EX)
+            try:
+                index = {}
+                if os.path.exists(self.path):
+                    with open(self.path) as f:
+                        index = json.load(f)
+                ret = func(index)
+                tmp = self.path + '.tmp'
+                with open(tmp, 'w') as f:
+                    json.dump(index, f, indent=4, sort_keys=True)
+                os.rename(tmp, self.path)
+                return ret
+            finally:
+                fcntl.flock(lockf.fileno(), fcntl.LOCK_UN)
+
+    def lookup(self, image):
+        """Returns True if @image (name:tag) is cached and still names
+        the image that was built, marking it as recently used."""
+        def do_lookup(index):
+            if image not in index:
+                return False
+            image_id = docker_image_id(image)
+            cached_id = index[image].get('id') or image_id
+            if image_id is None or _short_id(image_id) != _short_id(cached_id):
+                del index[image]
+                return False
+            index[image]['last-used'] = time.time()
+            return True
+        return self._locked(do_lookup)
+
+    def add(self, image, image_id):
+        def do_add(index):
+            now = time.time()
+            size = _docker_inspect(image, '{{.Size}}')
+            index[image] = { 'id': image_id,
+                             'created': now,
+                             'last-used': now,
+                             'size': int(size) if size else 0 }
+        self._locked(do_add)
+
+    def evict(self, max_age=None, max_size=None, keep=()):
+        """Remove images unused for more than @max_age seconds, then the
+        least recently used ones until they total at most @max_size
+        bytes.  Images in @keep are left alone."""
+        def do_evict(index):
+            now = time.time()
+            victims = []
+            lru = sorted(index.keys(), key=lambda i: index[i]['last-used'])
+            if max_age is not None:
+                victims.extend(i for i in lru
+                               if i not in keep and now - index[i]['last-used'] > max_age)
+            if max_size is not None:
+                total = sum(index[i]['size'] for i in lru if i not in victims)
+                for i in lru:
+                    if total <= max_size:
+                        break
+                    if i in keep or i in victims:
+                        continue
+                    victims.append(i)
+                    total -= index[i]['size']
+            for i in victims:
+                log("Evicting cached worker image {0}".format(i))
+                if subprocess.call(['docker', 'rmi', i]) != 0:
+                    # Most likely an image built on it still exists
+                    log("Failed to remove {0}; keeping it in the cache".format(i))
+                    continue
+                del index[i]
+        self._locked(do_evict)
@@ -0,0 +1,76 @@
+#!/bin/bash
+# ChecksumSink: checksums recorded while writing are only trusted
+# while the file is unchanged.
+
+set -e
+
+srcdir=${srcdir:-$(dirname $0)/..}
+
+exec ${PYTHON:-python} - "${srcdir}/src/py" "${srcdir}/t" <<'PYEOF'
+import os
+import sys
+import time
+import shutil
+import hashlib
+import tempfile
+
+sys.path[:0] = sys.argv[1:3]
+from testlib import check, finish
+from rpmostreecompose.checksums import ChecksumSink, hash_file
+
+tmpdir = tempfile.mkdtemp(prefix='toolbox-test')
+def path(name):
+    return os.path.join(tmpdir, name)
+
+try:
+    sink = ChecksumSink()
+    with sink.open(path('a')) as f:
+        f.write('hello ')
+        f.write('world')
+    digest = hashlib.sha256('hello world').hexdigest()
+    check(sink.lookup(path('a')) == digest, "checksum recorded while writing")
+    check(hash_file(path('a')) == digest, "hash_file() agrees")
+    check(sink.lookup(os.path.relpath(path('a'))) == digest, "lookups use absolute paths")
+
+    with open(path('a'), 'a') as f:
+        f.write('!')
+    check(sink.lookup(path('a')) is None, "appending invalidates the checksum")
+
+    with sink.open(path('b')) as f:
+        f.write('same size')
+    st = os.stat(path('b'))
+    with open(path('b'), 'w') as f:
+        f.write('SAME SIZE')
+    os.utime(path('b'), (st.st_atime, st.st_mtime + 10))
+    check(sink.lookup(path('b')) is None, "a rewrite with the same size but a new mtime invalidates it")
+
+    try:
+        with sink.open(path('c')) as f:
+            f.write('partial')
+            raise RuntimeError()
+    except RuntimeError:
+        pass
+    check(sink.lookup(path('c')) is None, "nothing is recorded when writing fails")
+
+    os.mkdir(path('dir'))
+    with sink.open(path('dir/d')) as f:
+        f.write('moved')
+    os.rename(path('dir'), path('moved'))
+    sink.moved(path('dir'), path('moved'))
+    check(sink.lookup(path('moved/d')) == hashlib.sha256('moved').hexdigest() and
+          sink.lookup(path('dir/d')) is None, "moved() follows renamed directories")
+
+    sink.copy(path('moved/d'), path('copy'))
+    check(sink.lookup(path('copy')) == hashlib.sha256('moved').hexdigest(), "copy() records the copy")
+
+    sink.write_sums(tmpdir, path('SHA256SUMS'), workers=2)
+    with open(path('SHA256SUMS')) as f:
+        sums = dict(reversed(line.split()) for line in f)
+    check(sorted(sums) == ['./a', './b', './c', './copy', './moved/d'], "every file but *SUMS is listed")
+    check(all(sums[name] == hash_file(path(name[2:])) for name in sums),
+          "stale and unrecorded files are hashed again")
+finally:
+    shutil.rmtree(tmpdir)
+
+finish()
+PYEOF
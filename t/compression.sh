@@ -0,0 +1,39 @@
+#!/bin/bash
+# Parsing of imagefactory --compress specs.
+
+set -e
+
+srcdir=${srcdir:-$(dirname $0)/..}
+
+exec ${PYTHON:-python} - "${srcdir}/src/py" "${srcdir}/t" <<'PYEOF'
+import sys
+
+sys.path[:0] = sys.argv[1:3]
+from testlib import check, exits, finish
+from rpmostreecompose.compression import parse_specs, OUTPUT_TYPES
+
+def codecs(specs, disabled=False):
+    ret = {}
+    for outtype, compressor in parse_specs(specs, disabled=disabled).iteritems():
+        ret[outtype] = None if compressor is None else str(compressor)
+    return ret
+
+check(codecs([]) == { 'qcow2': 'gzip', 'raw': None, 'hyperv': None, 'azure': 'zip' },
+      "default codecs")
+check(codecs(['zstd:19']) == { 'qcow2': 'zstd:19', 'raw': None, 'hyperv': None, 'azure': 'zstd:19' },
+      "a spec without a type replaces the defaults")
+check(codecs(['raw=xz', 'kvm=none']) == { 'qcow2': None, 'raw': 'xz', 'hyperv': None, 'azure': 'zip' },
+      "per-type specs, with kvm meaning qcow2")
+check(codecs(['xz', 'azure=gzip-parallel:4']) ==
+      { 'qcow2': 'xz', 'raw': None, 'hyperv': None, 'azure': 'gzip-parallel:4' },
+      "later specs override earlier ones")
+check(codecs(['raw=xz'], disabled=True) == dict((t, None) for t in OUTPUT_TYPES),
+      "--no-compression disables everything")
+check(exits(parse_specs, ['bzip3']), "unknown codecs are rejected")
+check(exits(parse_specs, ['xz:10']) and exits(parse_specs, ['gzip:0']),
+      "out of range levels are rejected")
+check(exits(parse_specs, ['gzip:fast']), "non-numeric levels are rejected")
+check(exits(parse_specs, ['vmdk=gzip']), "unknown output types are rejected")
+
+finish()
+PYEOF
@@ -0,0 +1,71 @@
+#!/bin/bash
+# Check that the cheap subcommands don't load the heavy dependencies of
+# the image building ones, and that startup stays fast.
+#
+# STARTUP_MAX_MS overrides the limit on the average time of
+# 'rpm-ostree-toolbox --version' (default: 500).
+
+set -e
+
+srcdir=${srcdir:-$(dirname $0)/..}
+
+exec ${PYTHON:-python} - "${srcdir}/src/py" "${STARTUP_MAX_MS:-500}" <<'PYEOF'
+import os
+import sys
+import time
+import subprocess
+
+pydir, max_ms = sys.argv[1], int(sys.argv[2])
+main_path = os.path.join(pydir, 'rpmostreecompose-main')
+# version.py is generated by configure, in the build directory
+built_version = os.path.abspath(os.path.join('src', 'py', 'rpmostreecompose', 'version.py'))
+
+HEAVY = ['imgfac', 'oz', 'libvirt', 'guestfs', 'gi', 'iniparse']
+MARKER = '--- loaded modules ---'
+
+# Runs rpmostreecompose-main as root would, then lists sys.modules
+CHILD = """
+import os, sys, imp
+sys.path.insert(0, %(pydir)r)
+if os.path.exists(%(version)r):
+    import rpmostreecompose
+    rpmostreecompose.version = imp.load_source('rpmostreecompose.version', %(version)r)
+os.getuid = lambda: 0
+sys.argv = ['rpm-ostree-toolbox'] + sys.argv[1:]
+main = imp.load_source('rpmostreecompose_main', %(main)r)
+try:
+    main.main()
+except SystemExit:
+    pass
+sys.stderr.write(%(marker)r + '\\n' + '\\n'.join(sys.modules.keys()))
+""" % { 'pydir': pydir, 'version': built_version, 'main': main_path, 'marker': MARKER }
+
+def run(argv):
+    p = subprocess.Popen([sys.executable, '-c', CHILD] + argv,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, err = p.communicate()
+    if MARKER not in err:
+        sys.stderr.write(err)
+        print "FAIL: '%s' didn't run" % (' '.join(argv), )
+        sys.exit(1)
+    return set(m for m in err.split(MARKER, 1)[1].splitlines() if m)
+
+failed = False
+for argv in [['--version'], ['docker-image', '--help'], ['serve-repo', '--help']]:
+    loaded = run(argv)
+    heavy = sorted(m for m in loaded if m.split('.')[0] in HEAVY)
+    if heavy:
+        print "FAIL: '%s' imports %s" % (' '.join(argv), ', '.join(heavy))
+        failed = True
+    else:
+        print "ok: '%s' imports %d modules" % (' '.join(argv), len(loaded))
+
+runs = 10
+start = time.time()
+for _ in xrange(runs):
+    run(['--version'])
+avg_ms = (time.time() - start) * 1000 / runs
+print "%s: '--version' takes %.1fms on average (limit %dms)" % ('ok' if avg_ms <= max_ms else 'FAIL', avg_ms, max_ms)
+if avg_ms > max_ms or failed:
+    sys.exit(1)
+PYEOF
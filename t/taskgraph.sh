@@ -0,0 +1,74 @@
+#!/bin/bash
+# TaskGraph: a failing node takes down its dependents and nothing
+# else, and 'after' orders nodes without propagating failures.
+
+set -e
+
+srcdir=${srcdir:-$(dirname $0)/..}
+
+exec ${PYTHON:-python} - "${srcdir}/src/py" "${srcdir}/t" <<'PYEOF'
+import sys
+import time
+import threading
+
+sys.path[:0] = sys.argv[1:3]
+from testlib import check, finish
+from rpmostreecompose.taskgraph import TaskGraph, COMPLETE, FAILED, SKIPPED
+
+def boom():
+    raise RuntimeError('boom')
+
+graph = TaskGraph(workers=4)
+graph.add('a', lambda: 1)
+graph.add('b', lambda a: a + 1, deps=['a'])
+graph.add('bad', boom)
+graph.add('child', lambda x: x, deps=['bad'])
+graph.add('grandchild', lambda x: x, deps=['child'])
+graph.add('mixed', lambda b, x: x, deps=['b', 'bad'])
+graph.add('waiter', lambda: 'ran', after=['bad'])
+result = graph.run()
+check(graph.state('b') == COMPLETE and graph.result('b') == 2, "results are passed to dependents")
+check(graph.state('bad') == FAILED, "a raising node fails")
+check(graph.state('child') == SKIPPED and graph.state('grandchild') == SKIPPED,
+      "failures propagate through dependencies")
+check(graph.state('mixed') == SKIPPED, "one failed dependency is enough to skip")
+check(graph.state('waiter') == COMPLETE and graph.result('waiter') == 'ran',
+      "'after' waits for a failed node but still runs")
+check(sorted(result) == ['bad', 'child', 'grandchild', 'mixed'],
+      "run() returns the failed and skipped nodes")
+
+def exits():
+    sys.exit(1)
+graph = TaskGraph(workers=2)
+graph.add('exits', exits)
+graph.add('next', lambda x: x, deps=['exits'])
+check(graph.run() == ['exits', 'next'], "SystemExit (fail_msg) counts as a failure")
+
+order = []
+lock = threading.Lock()
+def record(name, delay=0):
+    def func():
+        with lock:
+            order.append(('start', name))
+        time.sleep(delay)
+        with lock:
+            order.append(('end', name))
+    return func
+graph = TaskGraph(workers=4)
+graph.add('first', record('first', 0.2))
+graph.add('second', record('second'), after=['first'])
+graph.add('free', record('free'))
+graph.run()
+check(order.index(('end', 'first')) < order.index(('start', 'second')),
+      "'after' nodes start once the node they follow is done")
+check(order.index(('start', 'free')) < order.index(('end', 'first')),
+      "unrelated nodes run concurrently")
+
+try:
+    TaskGraph().add('x', lambda: None, deps=['missing'])
+    check(False, "unknown dependencies are rejected")
+except ValueError:
+    check(True, "unknown dependencies are rejected")
+
+finish()
+PYEOF
@@ -0,0 +1,23 @@
+# Shared by the Python test scripts under t/, which put this directory
+# on sys.path.
+
+import sys
+
+_failed = []
+
+def check(cond, msg):
+    print "%s: %s" % ('ok' if cond else 'FAIL', msg)
+    if not cond:
+        _failed.append(msg)
+
+def exits(func, *args):
+    """Returns True if func(*args) exits, as fail_msg() does."""
+    try:
+        func(*args)
+    except SystemExit:
+        return True
+    return False
+
+def finish():
+    if _failed:
+        sys.exit(1)
@@ -0,0 +1,73 @@
+#!/bin/bash
+# Treefile flattening: merge_lists(), include merging and cycles.
+
+set -e
+
+srcdir=${srcdir:-$(dirname $0)/..}
+
+exec ${PYTHON:-python} - "${srcdir}/src/py" "${srcdir}/t" <<'PYEOF'
+import os
+import sys
+import json
+import shutil
+import tempfile
+
+sys.path[:0] = sys.argv[1:3]
+from testlib import check, finish
+from rpmostreecompose.treefile import merge_lists, TreefileLoader
+
+check(merge_lists(['a', 'b', 'a'], ['c', 'b', 'd']) == ['a', 'b', 'c', 'd'],
+      "merge_lists() drops duplicates and keeps first-seen order")
+check(merge_lists([['x', 'y'], ['x', 'y']], [['z']]) == [['x', 'y'], ['z']],
+      "merge_lists() handles unhashable items")
+check(merge_lists([], []) == [], "merge_lists() of empty lists")
+
+tmpdir = tempfile.mkdtemp(prefix='toolbox-test')
+def write(name, params):
+    with open(os.path.join(tmpdir, name), 'w') as f:
+        json.dump(params, f)
+    return os.path.join(tmpdir, name)
+
+try:
+    loader = TreefileLoader(statedir=os.path.join(tmpdir, 'state'))
+
+    # A diamond: top includes left and right, which both include base
+    write('base.json', { 'packages': ['kernel', 'bash'], 'ref': 'base', 'comment': 'x' })
+    write('left.json', { 'include': 'base.json', 'packages': ['vim'] })
+    write('right.json', { 'include': ['base.json'], 'packages': ['bash', 'git'] })
+    top = write('top.json', { 'include': ['left.json', 'right.json'],
+                              'packages': ['docker'], 'ref': 'top' })
+    params = loader.load(top)
+    check(params['packages'] == ['docker', 'vim', 'kernel', 'bash', 'git'],
+          "included lists are merged in order without duplicates")
+    check(params['ref'] == 'top', "keys of the including file win")
+    check('include' not in params and 'comment' not in params,
+          "include and included comments are dropped")
+
+    params['packages'].append('mutated')
+    check('mutated' not in loader.load(top)['packages'], "callers get their own copy")
+
+    write('base.json', { 'packages': ['kernel', 'systemd'], 'ref': 'base' })
+    check(TreefileLoader(statedir=os.path.join(tmpdir, 'state')).load(top)['packages']
+          == ['docker', 'vim', 'kernel', 'systemd', 'bash', 'git'], "changing an included file invalidates the cache")
+
+    write('a.json', { 'include': 'b.json' })
+    write('b.json', { 'include': 'c.json' })
+    write('c.json', { 'include': 'a.json' })
+    try:
+        loader.load(os.path.join(tmpdir, 'a.json'))
+        check(False, "include cycles are detected")
+    except SystemExit:
+        check(True, "include cycles are detected")
+
+    write('self.json', { 'include': 'self.json' })
+    try:
+        loader.load(os.path.join(tmpdir, 'self.json'))
+        check(False, "a treefile including itself is a cycle")
+    except SystemExit:
+        check(True, "a treefile including itself is a cycle")
+finally:
+    shutil.rmtree(tmpdir)
+
+finish()
+PYEOF
@@ -0,0 +1,107 @@
+#!/bin/bash
+# The repo http server: byte ranges, 416 for unsatisfiable ranges, and
+# keep-alive with exact Content-Lengths.
+
+set -e
+
+srcdir=${srcdir:-$(dirname $0)/..}
+
+exec ${PYTHON:-python} - "${srcdir}/src/py" "${srcdir}/t" <<'PYEOF'
+import os
+import sys
+import shutil
+import httplib
+import tempfile
+import time
+
+sys.path[:0] = sys.argv[1:3]
+from testlib import check, finish
+from rpmostreecompose.webserver import ADMIT_TIMEOUT, TemporaryWebserver
+
+tmpdir = tempfile.mkdtemp(prefix='toolbox-test')
+content = ''.join(chr(i % 256) for i in xrange(100000))
+with open(os.path.join(tmpdir, 'object'), 'wb') as f:
+    f.write(content)
+open(os.path.join(tmpdir, 'empty'), 'w').close()
+
+server = TemporaryWebserver(workers=2)
+port = server.start(tmpdir)
+# One connection for everything, which also checks keep-alive
+conn = httplib.HTTPConnection('127.0.0.1', port, timeout=10)
+
+def get(path, byterange=None, method='GET'):
+    headers = {}
+    if byterange is not None:
+        headers['Range'] = byterange
+    conn.request(method, path, headers=headers)
+    resp = conn.getresponse()
+    return resp.status, dict(resp.getheaders()), resp.read()
+
+try:
+    status, headers, body = get('/object')
+    check(status == 200 and body == content and headers['content-length'] == str(len(content)),
+          "whole file with its Content-Length")
+    check(headers.get('accept-ranges') == 'bytes', "ranges are advertised")
+
+    status, headers, body = get('/object', 'bytes=10-19')
+    check(status == 206 and body == content[10:20], "bounded range")
+    check(headers.get('content-range') == 'bytes 10-19/100000', "Content-Range of a bounded range")
+
+    status, headers, body = get('/object', 'bytes=99990-')
+    check(status == 206 and body == content[99990:], "open-ended range")
+
+    status, headers, body = get('/object', 'bytes=-5')
+    check(status == 206 and body == content[-5:] and
+          headers.get('content-range') == 'bytes 99995-99999/100000', "suffix range")
+
+    status, headers, body = get('/object', 'bytes=99998-200000')
+    check(status == 206 and body == content[99998:], "a range past the end is clipped")
+
+    status, headers, body = get('/object', 'bytes=100000-')
+    check(status == 416 and body == '' and headers.get('content-range') == 'bytes */100000',
+          "416 for a range starting past the end")
+
+    status, headers, body = get('/object', 'bytes=20-10')
+    check(status == 416, "416 for a reversed range")
+
+    status, headers, body = get('/empty', 'bytes=0-')
+    check(status == 416 and headers.get('content-range') == 'bytes */0', "416 for any range of an empty file")
+
+    status, headers, body = get('/object', 'bytes=0-1,5-6')
+    check(status == 200 and body == content, "multiple ranges get the whole file")
+
+    status, headers, body = get('/object', 'bytes=10-19', method='HEAD')
+    check(status == 206 and body == '' and headers['content-length'] == '10', "HEAD of a range")
+
+    status, headers, body = get('/missing')
+    check(status == 404, "404 for a missing file")
+
+    status, headers, body = get('/object', 'bytes=0-3')
+    check(status == 206 and body == content[:4], "the connection is still usable afterwards")
+finally:
+    conn.close()
+    server.stop(drain_timeout=5)
+
+# With a cap of one connection, an idle keep-alive connection is
+# closed to make room for a new one
+server = TemporaryWebserver(max_connections=1)
+port = server.start(tmpdir)
+first = httplib.HTTPConnection('127.0.0.1', port, timeout=10)
+second = httplib.HTTPConnection('127.0.0.1', port, timeout=10)
+try:
+    first.request('GET', '/empty')
+    first.getresponse().read()
+    started = time.time()
+    second.request('GET', '/empty')
+    resp = second.getresponse()
+    resp.read()
+    check(resp.status == 200 and time.time() - started < ADMIT_TIMEOUT,
+          "an idle connection doesn't hold the only slot")
+finally:
+    first.close()
+    second.close()
+    server.stop(drain_timeout=5)
+    shutil.rmtree(tmpdir)
+
+finish()
+PYEOF
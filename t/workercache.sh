@@ -0,0 +1,24 @@
+#!/bin/bash
+# Parsing of sizes (worker_cache_max_size, gc --max-cache-size).
+
+set -e
+
+srcdir=${srcdir:-$(dirname $0)/..}
+
+exec ${PYTHON:-python} - "${srcdir}/src/py" "${srcdir}/t" <<'PYEOF'
+import sys
+
+sys.path[:0] = sys.argv[1:3]
+from testlib import check, exits, finish
+from rpmostreecompose.workercache import parse_size
+
+check(parse_size(None) is None and parse_size('') is None, "parse_size() of nothing is None")
+check(parse_size('4096') == 4096 and parse_size(4096) == 4096, "plain byte counts")
+check(parse_size('500M') == 500 * 1024 ** 2, "M suffix")
+check(parse_size('20g') == 20 * 1024 ** 3, "suffixes are case-insensitive")
+check(parse_size(' 1.5K ') == 1536, "fractions and surrounding blanks")
+check(parse_size('2T') == 2 * 1024 ** 4, "T suffix")
+check(exits(parse_size, '12Q') and exits(parse_size, 'lots'), "invalid sizes are rejected")
+
+finish()
+PYEOF